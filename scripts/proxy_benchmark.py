@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+VTY Proxy Benchmark
+HTTP load generator for vty_proxy.py routes; reports throughput and latency
+percentiles as JSON. Can start the proxy against vty_emulator.py itself.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Commands the dashboard batches on every refresh (web/dashboard.html STREAM_SECTIONS)
+DASHBOARD_COMMANDS = [
+    'show cs7 instance 0 users',
+    'show cs7 instance 0 asp',
+    'show cs7 instance 0 as all'
+]
+
+# Read-only commands used by the 'command' request type
+SHOW_COMMANDS = [
+    ('stp', 'show cs7 instance 0 asp'),
+    ('msc', 'show subscribers'),
+    ('msc', 'show stats'),
+    ('bsc', 'show bts'),
+    ('hlr', 'show subscribers'),
+    ('mgw', 'show mgcp stats')
+]
+
+# Per-iteration request sequences of the built-in scenarios
+SCENARIOS = {
+    'dashboard': ['batch', 'status', 'health'],  # one dashboard refresh
+    'status': ['status'],
+    'command': ['command'],
+    'sms-burst': ['sms']                         # repeated --burst times per iteration
+}
+
+# Emulated service ports, as in vty_emulator.SERVICES
+EMULATOR_PORTS = {'stp': 4239, 'msc': 4254, 'bsc': 4242, 'hlr': 4258, 'mgw': 2427}
+
+
+def build_request(kind):
+    """(method, path, JSON body or None) for a request type"""
+    if kind == 'status':
+        return 'GET', '/api/status', None
+    if kind == 'health':
+        return 'GET', '/health', None
+    if kind == 'batch':
+        return 'POST', '/api/command/batch', {'service': 'stp', 'commands': DASHBOARD_COMMANDS}
+    if kind == 'command':
+        service, command = random.choice(SHOW_COMMANDS)
+        return 'POST', '/api/command', {'service': service, 'command': command}
+    if kind == 'sms':
+        return 'POST', '/api/sms/send', {
+            'from': str(random.randint(1000, 1999)),
+            'to': str(random.randint(1000, 1999)),
+            'message': f"benchmark {random.randint(0, 999999)}"
+        }
+    raise ValueError(f"Unknown request type: {kind}")
+
+
+def parse_mix(spec):
+    """'status=3,sms=1' -> [(kind, weight)]"""
+    mix = []
+    for item in spec.split(','):
+        kind, _, weight = item.partition('=')
+        build_request(kind.strip())  # validate
+        mix.append((kind.strip(), float(weight or 1)))
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.4999)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (ms) of a list of seconds"""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': {
+            'mean': round(sum(values) / len(values) * 1000, 3) if values else None,
+            'p50': round(percentile(values, 50) * 1000, 3) if values else None,
+            'p95': round(percentile(values, 95) * 1000, 3) if values else None,
+            'p99': round(percentile(values, 99) * 1000, 3) if values else None,
+            'max': round(values[-1] * 1000, 3) if values else None
+        }
+    }
+
+
+class Worker(threading.Thread):
+    """Closed-loop client: runs its scenario over one keep-alive connection"""
+
+    def __init__(self, benchmark):
+        super().__init__(daemon=True)
+        self.benchmark = benchmark
+        self.latencies = {}    # request type -> [seconds]
+        self.statuses = {}     # request type -> {status: count}
+        self.job_ids = []
+        self.conn = None
+
+    def run(self):
+        bench = self.benchmark
+        while not bench.finished():
+            for kind in bench.iteration():
+                if not bench.take_request():
+                    return
+                self.request(kind)
+            if bench.think:
+                time.sleep(bench.think)
+
+    def request(self, kind):
+        bench = self.benchmark
+        method, path, body = build_request(kind)
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = dict(bench.headers)
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+
+        started = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(bench.host, bench.port, timeout=bench.timeout)
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = str(response.status)
+            if response.will_close:
+                self.conn.close()
+                self.conn = None
+        except Exception as e:
+            status = type(e).__name__
+            data = b''
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+        elapsed = time.perf_counter() - started
+
+        self.latencies.setdefault(kind, []).append(elapsed)
+        counts = self.statuses.setdefault(kind, {})
+        counts[status] = counts.get(status, 0) + 1
+        if kind == 'sms' and status == '202':
+            try:
+                self.job_ids.append(json.loads(data)['job_id'])
+            except (ValueError, KeyError):
+                pass
+
+
+class Benchmark:
+    """Runs workers for a duration or request budget and aggregates their results"""
+
+    def __init__(self, url, scenario, mix=None, concurrency=10, duration=30.0, requests=0,
+                 think=0.0, burst=20, timeout=30.0, headers=None):
+        target = urlparse(url)
+        self.url = url
+        self.host = target.hostname
+        self.port = target.port or 80
+        self.scenario = scenario
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.think = think
+        self.burst = burst
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.deadline = None
+        self._issued = itertools.count()
+
+    def iteration(self):
+        """Request types for one iteration of the scenario"""
+        if self.mix:
+            kinds, weights = zip(*self.mix)
+            return random.choices(kinds, weights)
+        if self.scenario == 'sms-burst':
+            return ['sms'] * self.burst
+        return SCENARIOS[self.scenario]
+
+    def take_request(self):
+        """Reserve one request from the budget (and check the deadline)"""
+        if self.finished():
+            return False
+        return not self.requests or next(self._issued) < self.requests
+
+    def finished(self):
+        return time.monotonic() >= self.deadline
+
+    def run(self):
+        self.deadline = time.monotonic() + (self.duration if self.duration > 0 else float('inf'))
+        workers = [Worker(self) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        latencies, statuses, job_ids = {}, {}, []
+        for worker in workers:
+            for kind, values in worker.latencies.items():
+                latencies.setdefault(kind, []).extend(values)
+            for kind, counts in worker.statuses.items():
+                merged = statuses.setdefault(kind, {})
+                for status, count in counts.items():
+                    merged[status] = merged.get(status, 0) + count
+            job_ids.extend(worker.job_ids)
+
+        routes = {}
+        for kind, values in sorted(latencies.items()):
+            method, path, _ = build_request(kind)
+            errors = sum(count for status, count in statuses[kind].items() if not status.startswith(('2', '3')))
+            routes[kind] = {'route': f'{method} {path}', **summarize(values, elapsed),
+                            'errors': errors, 'status_codes': statuses[kind]}
+
+        all_latencies = [value for values in latencies.values() for value in values]
+        result = {
+            'config': {
+                'url': self.url,
+                'scenario': 'mix' if self.mix else self.scenario,
+                'mix': dict(self.mix) if self.mix else None,
+                'concurrency': self.concurrency,
+                'duration': self.duration,
+                'requests': self.requests,
+                'think_ms': self.think * 1000,
+                'burst': self.burst if self.scenario == 'sms-burst' else None,
+                'headers': self.headers
+            },
+            'elapsed_s': round(elapsed, 3),
+            'overall': {**summarize(all_latencies, elapsed),
+                        'errors': sum(route['errors'] for route in routes.values())},
+            'routes': routes
+        }
+        return result, job_ids
+
+    def sms_outcomes(self, job_ids, drain=30.0):
+        """Wait for queued SMS jobs to finish and summarize queue-to-sent times"""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        deadline = time.monotonic() + drain
+        states, end_to_end, pending = {}, [], list(job_ids)
+        while pending and time.monotonic() < deadline:
+            still_pending = []
+            for job_id in pending:
+                conn.request('GET', f'/api/sms/jobs/{job_id}')
+                response = conn.getresponse()
+                job = json.loads(response.read() or b'{}')
+                if job.get('state') in ('sent', 'failed'):
+                    states[job['state']] = states.get(job['state'], 0) + 1
+                    end_to_end.append(job['finished_at'] - job['queued_at'])
+                elif response.status == 404:
+                    states['expired'] = states.get('expired', 0) + 1
+                else:
+                    still_pending.append(job_id)
+            pending = still_pending
+            if pending:
+                time.sleep(0.5)
+        conn.close()
+
+        if pending:
+            states['unfinished'] = len(pending)
+        span = max(end_to_end) if end_to_end else 0
+        summary = summarize(end_to_end, span)
+        return {'jobs': len(job_ids), 'states': states,
+                'queue_to_done_ms': summary['latency_ms']}
+
+
+def wait_healthy(url, timeout=20.0):
+    """Wait until the proxy answers /health with 200"""
+    target = urlparse(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=2)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def start_local_stack(port_offset, emulator_args):
+    """Start vty_emulator.py and a vty_proxy.py wired to it; returns the processes"""
+    emulator = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, 'vty_emulator.py'),
+         '--port-offset', str(port_offset)] + emulator_args.split(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    env = dict(os.environ)
+    for service, port in EMULATOR_PORTS.items():
+        env[f'OSMO_{service.upper()}_HOST'] = '127.0.0.1'
+        env[f'OSMO_{service.upper()}_PORT'] = str(port + port_offset)
+    proxy = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, 'vty_proxy.py')], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return [proxy, emulator]
+
+
+def main():
+    """Main function with CLI interface"""
+    parser = argparse.ArgumentParser(description='VTY proxy HTTP benchmark')
+    parser.add_argument('--url', default='http://localhost:5000', help='Proxy base URL')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='dashboard',
+                        help='Request pattern per iteration (default: dashboard refresh)')
+    parser.add_argument('--mix', help='Weighted random requests instead of a scenario, '
+                                      'e.g. status=3,command=5,batch=2,sms=1,health=1')
+    parser.add_argument('--concurrency', type=int, default=10, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run (0 = until --requests)')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests (0 = no limit)')
+    parser.add_argument('--think', type=float, default=0.0, help='Milliseconds each client waits between iterations')
+    parser.add_argument('--burst', type=int, default=20, help='SMS per iteration in the sms-burst scenario')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+    parser.add_argument('--no-cache', action='store_true', help='Send Cache-Control: no-cache to bypass proxy caches')
+    parser.add_argument('--gzip', action='store_true', help='Send Accept-Encoding: gzip')
+    parser.add_argument('--sms-drain', type=float, default=30.0,
+                        help='Seconds to wait for queued SMS jobs to finish after the run')
+    parser.add_argument('--emulator', action='store_true',
+                        help='Start vty_emulator.py and vty_proxy.py locally for the run')
+    parser.add_argument('--emulator-port-offset', type=int, default=10000, help='Port offset for the emulator')
+    parser.add_argument('--emulator-args', default='', help='Extra vty_emulator.py arguments, e.g. "--latency 20"')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    args = parser.parse_args()
+    if args.duration <= 0 and args.requests <= 0:
+        parser.error('--duration 0 needs --requests')
+
+    headers = {}
+    if args.no_cache:
+        headers['Cache-Control'] = 'no-cache'
+    if args.gzip:
+        headers['Accept-Encoding'] = 'gzip'
+
+    processes = []
+    try:
+        if args.emulator:
+            processes = start_local_stack(args.emulator_port_offset, args.emulator_args)
+            if not wait_healthy(args.url):
+                raise SystemExit('Proxy did not become healthy against the emulator')
+
+        benchmark = Benchmark(args.url, args.scenario, parse_mix(args.mix) if args.mix else None,
+                              concurrency=args.concurrency, duration=args.duration, requests=args.requests,
+                              think=args.think / 1000, burst=args.burst, timeout=args.timeout, headers=headers)
+        print(f"Benchmarking {args.url} ({args.mix or args.scenario}, {args.concurrency} clients)...",
+              file=sys.stderr)
+        result, job_ids = benchmark.run()
+        if job_ids:
+            result['sms'] = benchmark.sms_outcomes(job_ids, args.sms_drain)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+    overall = result['overall']
+    print(f"{overall['count']} requests, {overall['throughput_rps']} req/s, "
+          f"p50 {overall['latency_ms']['p50']} ms, p99 {overall['latency_ms']['p99']} ms, "
+          f"{overall['errors']} errors", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
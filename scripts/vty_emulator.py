@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+Osmocom VTY Emulator
+Local stand-in for the STP/MSC/HLR/BSC/MGW telnet VTYs, for load-testing
+vty_proxy.py and ss7_sms_simulator.py without the Docker stack
+"""
+
+import re
+import json
+import random
+import asyncio
+import argparse
+import logging
+from dataclasses import dataclass, fields
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SERVICES = {
+    'stp': {'name': 'OsmoSTP', 'port': 4239},
+    'msc': {'name': 'OsmoMSC', 'port': 4254},
+    'bsc': {'name': 'OsmoBSC', 'port': 4242},
+    'hlr': {'name': 'OsmoHLR', 'port': 4258},
+    'mgw': {'name': 'OsmoMGW', 'port': 2427}
+}
+
+BANNER = (
+    "Welcome to the {name} VTY interface\r\n"
+    "\r\n"
+    "Copyright (C) 2008-2023 by the Osmocom project contributors\r\n"
+    "License AGPLv3+: GNU AGPL version 3 or later <http://gnu.org/licenses/agpl-3.0.html>\r\n"
+    "This is free software: you are free to change and redistribute it.\r\n"
+    "There is NO WARRANTY, to the extent permitted by law.\r\n"
+    "\r\n"
+)
+
+# IAC WILL ECHO, IAC WILL SUPPRESS-GO-AHEAD, IAC DONT LINEMODE, as libosmovty sends on connect
+TELNET_NEGOTIATION = b'\xff\xfb\x01\xff\xfb\x03\xff\xfe\x22'
+TELNET_IAC_RE = re.compile(rb'\xff(?:[\xfb-\xfe].|\xfa.*?\xff\xf0|[^\xff])', re.S)
+
+UNKNOWN_COMMAND = "% Unknown command."
+
+# Command syntaxes printed by 'list', per service (common ones are added to all)
+COMMON_SYNTAX = [
+    'show version',
+    'show running-config',
+    'show stats',
+    'list',
+    'enable',
+    'disable',
+    'configure terminal',
+    'exit',
+    'end',
+    'write terminal'
+]
+SERVICE_SYNTAX = {
+    'stp': ['show cs7 instance <0-15> users', 'show cs7 instance <0-15> asp',
+            'show cs7 instance <0-15> as (active|all|m3ua|sua)'],
+    'msc': ['show subscribers', 'show calls', 'show sms queue',
+            'subscriber (msisdn|extension|imsi|tmsi|id) ID sms sender (msisdn|extension|imsi|tmsi|id) SENDER_ID send .LINE'],
+    'bsc': ['show network', 'show bts [<0-255>]', 'show trx [<0-255>] [<0-255>]', 'show paging [<0-255>]'],
+    'hlr': ['show subscribers',
+            'subscriber (imsi|msisdn|id|imei) IDENT show',
+            'subscriber imsi IDENT create',
+            'subscriber (imsi|msisdn|id|imei) IDENT delete',
+            'subscriber (imsi|msisdn|id|imei) IDENT update msisdn (none|MSISDN)'],
+    'mgw': ['show mgcp stats', 'show mgcp']
+}
+
+
+@dataclass
+class Behaviour:
+    """How a service answers: timing, size and failure injection"""
+    latency: float = 0.0         # ms before every reply
+    jitter: float = 0.0          # ms, uniformly random extra delay
+    drip_bytes: int = 0          # send replies in chunks of this many bytes (0 = all at once)
+    drip_interval: float = 10.0  # ms between drip chunks
+    hang_rate: float = 0.0       # probability that a command hangs its connection
+    hang_match: str = ''         # regex; matching commands hang their connection
+    hang_banner: bool = False    # accept connections but never send the banner
+    rows: int = 10               # rows/entries in generated show output
+
+    def apply(self, overrides):
+        """Set fields from "key=value,key=value" (used by --override)"""
+        types = {field.name: field.type for field in fields(self)}
+        for item in overrides.split(','):
+            key, value = item.split('=', 1)
+            key = key.strip().replace('-', '_')
+            if key not in types:
+                raise ValueError(f"Unknown behaviour setting: {key}")
+            kind = types[key]
+            if kind is bool:
+                setattr(self, key, value.strip().lower() in ('1', 'true', 'yes', 'on'))
+            else:
+                setattr(self, key, kind(value))
+        return self
+
+
+def table(columns, rows):
+    """Fixed-width table with a dashed underline, like the Osmocom 'show' tables"""
+    widths = [max([len(column)] + [len(str(row[n])) for row in rows]) for n, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(widths[n]) for n, column in enumerate(columns)).rstrip(),
+             '  '.join('-' * width for width in widths)]
+    for row in rows:
+        lines.append('  '.join(str(cell).ljust(widths[n]) for n, cell in enumerate(row)).rstrip())
+    return lines
+
+
+def default_imsi(msisdn):
+    return f"001010{msisdn.zfill(9)}"
+
+
+class EmulatedService:
+    """State and command handlers of one emulated Osmocom program"""
+
+    def __init__(self, service, behaviour, canned=None):
+        self.service = service
+        self.name = SERVICES[service]['name']
+        self.hostname = self.name
+        self.behaviour = behaviour
+        self.canned = canned or {}
+        self.hang_re = re.compile(behaviour.hang_match) if behaviour.hang_match else None
+        self.connections = 0
+        self.commands = 0
+        self.sms_submitted = 0
+
+        # HLR subscriber store: imsi -> {'id', 'imsi', 'msisdn'}
+        self.subscribers = {}
+        self.next_id = 1
+        if service == 'hlr':
+            for n in range(behaviour.rows):
+                msisdn = str(1000 + n)
+                self.create_subscriber(default_imsi(msisdn), msisdn)
+
+    # -- Dispatch -------------------------------------------------------
+
+    def execute(self, session, command):
+        """Output lines for one command line, updating the session's node"""
+        words = command.split()
+        if not words:
+            return []
+        self.commands += 1
+        line = ' '.join(words)
+
+        if line in self.canned:
+            return self.canned[line].splitlines()
+
+        if line == 'enable':
+            session.node = 'enable' if session.node == 'view' else session.node
+            return []
+        if line == 'disable':
+            session.node = 'view' if session.node == 'enable' else session.node
+            return []
+        if line in ('configure terminal', 'configure'):
+            if session.node != 'enable':
+                return [UNKNOWN_COMMAND]
+            session.node = 'config'
+            return []
+        if line == 'end':
+            session.node = 'enable' if session.node == 'config' else session.node
+            return []
+        if line in ('exit', 'quit'):
+            if session.node == 'config':
+                session.node = 'enable'
+                return []
+            session.closing = True
+            return []
+        if line == 'list':
+            return COMMON_SYNTAX + SERVICE_SYNTAX.get(self.service, [])
+
+        if session.node == 'config':
+            if words[0] == 'hostname' and len(words) == 2:
+                self.hostname = words[1]
+            elif words[:2] == ['no', 'hostname']:
+                self.hostname = self.name
+            # Other configuration is accepted and ignored
+            return []
+
+        if line == 'show version':
+            return [f"{self.name} 1.10.0 (emulated)", "(C) Osmocom project, emulated by vty_emulator.py"]
+        if line in ('show running-config', 'write terminal'):
+            return self.running_config()
+        if line == 'show stats':
+            return self.stats()
+
+        handler = getattr(self, f'cmd_{self.service}', None)
+        output = handler(words, line) if handler else None
+        return [UNKNOWN_COMMAND] if output is None else output
+
+    def prompt(self, session):
+        suffix = {'view': '>', 'enable': '#', 'config': '(config)#'}[session.node]
+        return f"{self.hostname}{suffix} "
+
+    def should_hang(self, line):
+        if self.hang_re is not None and self.hang_re.search(line):
+            return True
+        return self.behaviour.hang_rate > 0 and random.random() < self.behaviour.hang_rate
+
+    # -- Generated output shared by all services ------------------------
+
+    def running_config(self):
+        lines = ["", "Current configuration:", "!", "!", f"hostname {self.hostname}", "!",
+                 "line vty", " no login", " bind 0.0.0.0", "!"]
+        lines += [f"! generated line {n}" for n in range(self.behaviour.rows)]
+        return lines + ["end"]
+
+    def stats(self):
+        counters = {
+            'stp': ['M3UA Messages received', 'M3UA Messages sent', 'SCCP Messages routed'],
+            'msc': ['Location Update Requests', 'SMS MO submitted', 'SMS MT delivered', 'Calls established'],
+            'bsc': ['Channel requests', 'Paging attempts', 'Handover attempts'],
+            'hlr': ['GSUP requests', 'Location updates', 'Send Auth Info requests'],
+            'mgw': ['CRCX commands', 'MDCX commands', 'DLCX commands']
+        }[self.service]
+        counters += [f'Emulated counter {n}' for n in range(max(0, self.behaviour.rows - len(counters)))]
+
+        lines = [f"{self.name} statistics:"]
+        for n, counter in enumerate(counters):
+            value = self.commands * (n + 1) + (self.sms_submitted if 'SMS' in counter else 0)
+            lines.append(f"  {counter}: {value:>10} (0/s {value % 60}/m {value % 3600}/h {value}/d)")
+        return lines
+
+    # -- Per-service commands ------------------------------------------
+
+    def cmd_stp(self, words, line):
+        match = re.fullmatch(r'show cs7 instance (\d+) (users|asp|as (?:active|all|m3ua|sua))', line)
+        if not match:
+            return None
+        rows = self.behaviour.rows
+        if match.group(2) == 'users':
+            return ["SI 3: SCCP", "SI 5: ISUP"][:max(1, min(2, rows))]
+        if match.group(2) == 'asp':
+            return table(['ASP Name', 'AS Name', 'State', 'Type', 'Remote IP Addr:Rmt Port', 'SCTP Role'],
+                         [(f'asp-clnt-{n}', f'as-clnt-{n}', 'ASP_ACTIVE', 'm3ua',
+                           f'172.20.{n // 250}.{n % 250 + 1}:2905', 'server') for n in range(rows)])
+        return table(['AS Name', 'State', 'Context', 'Dpc', 'Si', 'Opc', 'Ssn', 'Mode'],
+                     [(f'as-clnt-{n}', 'AS_ACTIVE', n + 1, f'0.23.{n % 8}', '3', '0.23.1', '-', 'override')
+                      for n in range(rows)])
+
+    def cmd_msc(self, words, line):
+        rows = self.behaviour.rows
+        if line == 'show subscribers':
+            return table(['ID', 'MSISDN', 'IMSI', 'IMEI', 'LAC', 'Use'],
+                         [(n + 1, str(1000 + n), default_imsi(str(1000 + n)), f'35{n:013d}', 1, 1)
+                          for n in range(rows)])
+        if line == 'show calls':
+            return [f"Call {n}: callref 0x{n + 1:x} {1000 + n} -> {1000 + rows + n} state ACTIVE"
+                    for n in range(rows)] or ["No active calls"]
+        if line == 'show sms queue':
+            return [f"SMS queue: {self.sms_submitted} submitted, 0 pending, {self.sms_submitted} delivered"]
+        if re.fullmatch(r'subscriber (msisdn|extension|imsi|tmsi|id) \S+ sms sender '
+                        r'(msisdn|extension|imsi|tmsi|id) \S+ send .+', line):
+            self.sms_submitted += 1
+            return []
+        return None
+
+    def cmd_bsc(self, words, line):
+        rows = self.behaviour.rows
+        bts_count = max(1, rows // 10)
+        if line == 'show network':
+            return ["BSC is on MCC-MNC 001-01 and has %d BTS" % bts_count,
+                    "  Encryption: A5/0", "  NECI (TCH/H): 1", "  Use TCH for Paging any: 0",
+                    "  MSC Connections: 1"]
+        if re.fullmatch(r'show bts( \d+)?', line):
+            lines = []
+            for n in range(bts_count):
+                lines += [f"BTS {n} is of osmo-bts type in band DCS1800, has CI {n} LAC 1, "
+                          f"BSIC 63 (NCC=7, BCC=7) and 1 TRX",
+                          "  Description: (null)",
+                          "  ARFCNs: 871",
+                          "  Number of TRX: 1",
+                          "  Paging: 0 pending requests"]
+            return lines
+        if re.fullmatch(r'show trx( \d+)*', line):
+            return [f"TRX 0 of BTS {n} is on ARFCN 871" for n in range(bts_count)] + \
+                   ["  RF Nominal Power: 23 dBm, reduced by 0 dB, resulting BS power: 23 dBm"]
+        if re.fullmatch(r'show paging( \d+)?', line):
+            return [f"Paging requests for BTS {n}: 0" for n in range(bts_count)]
+        return None
+
+    def cmd_hlr(self, words, line):
+        if line in ('show subscribers', 'show subscribers all'):
+            return table(['ID', 'MSISDN', 'IMSI', 'IMEI', 'NAM'],
+                         [(sub['id'], sub['msisdn'] or '-', sub['imsi'], '-', 'CS+PS')
+                          for sub in self.subscribers.values()])
+
+        # OsmoHLR's "subscriber <kind> <id> <action>", plus the proxy's "subscriber <action> <kind> <id>"
+        match = re.fullmatch(r'subscriber (?P<kind>imsi|msisdn|id|imei) (?P<ident>\S+) '
+                             r'(?P<action>show|create|delete)', line) or \
+            re.fullmatch(r'subscriber (?P<action>show|create|delete) (?P<kind>imsi|msisdn|id|imei) '
+                         r'(?P<ident>\S+)', line)
+        if match:
+            return self.subscriber_action(match['kind'], match['ident'], match['action'])
+
+        match = re.fullmatch(r'subscriber (imsi|msisdn|id|imei) (\S+) update msisdn (\S+)', line)
+        if match:
+            subscriber = self.find_subscriber(match.group(1), match.group(2))
+            if subscriber is None:
+                return [f"% No subscriber for {match.group(1)} = '{match.group(2)}'"]
+            subscriber['msisdn'] = None if match.group(3) == 'none' else match.group(3)
+            return []
+        return None
+
+    def subscriber_action(self, kind, ident, action):
+        if action == 'create':
+            if kind != 'imsi' or ident in self.subscribers:
+                return [f"% No subscriber created for IMSI {ident}"]
+            self.create_subscriber(ident)
+            return []
+
+        subscriber = self.find_subscriber(kind, ident)
+        if subscriber is None:
+            return [f"% No subscriber for {kind} = '{ident}'"]
+        if action == 'delete':
+            del self.subscribers[subscriber['imsi']]
+            return []
+        return [f"    ID: {subscriber['id']}",
+                f"    IMSI: {subscriber['imsi']}",
+                f"    MSISDN: {subscriber['msisdn'] or '(none)'}"]
+
+    def create_subscriber(self, imsi, msisdn=None):
+        self.subscribers[imsi] = {'id': self.next_id, 'imsi': imsi, 'msisdn': msisdn}
+        self.next_id += 1
+
+    def find_subscriber(self, kind, ident):
+        if kind == 'imsi':
+            return self.subscribers.get(ident)
+        for subscriber in self.subscribers.values():
+            if kind == 'msisdn' and subscriber['msisdn'] == ident or \
+                    kind == 'id' and str(subscriber['id']) == ident:
+                return subscriber
+        return None
+
+    def cmd_mgw(self, words, line):
+        rows = self.behaviour.rows
+        if line == 'show mgcp stats':
+            lines = ["MGCP statistics:"]
+            for n, counter in enumerate(['CRCX success', 'CRCX failed', 'MDCX success', 'DLCX success']
+                                        + [f'Endpoint counter {n}' for n in range(max(0, rows - 4))]):
+                value = self.commands * (n + 1)
+                lines.append(f"  {counter}: {value:>10} (0/s {value % 60}/m {value % 3600}/h {value}/d)")
+            return lines
+        if line == 'show mgcp':
+            return [f"Endpoint: rtpbridge/{n}@mgw  CONN: 0" for n in range(rows)]
+        return None
+
+
+class VTYSession:
+    """Per-connection VTY state"""
+
+    def __init__(self):
+        self.node = 'view'
+        self.hung = False
+        self.closing = False
+
+
+class EmulatorServer:
+    """Telnet-style VTY server for one emulated service"""
+
+    def __init__(self, service, bind, port):
+        self.service = service
+        self.bind = bind
+        self.port = port
+
+    async def start(self):
+        return await asyncio.start_server(self.handle, self.bind, self.port)
+
+    async def handle(self, reader, writer):
+        backend = self.service
+        behaviour = backend.behaviour
+        session = VTYSession()
+        backend.connections += 1
+        try:
+            if behaviour.hang_banner:
+                await self.swallow(reader)
+                return
+
+            writer.write(TELNET_NEGOTIATION + BANNER.format(name=backend.name).encode() +
+                         backend.prompt(session).encode())
+            await writer.drain()
+
+            buffer = b''
+            while not session.closing:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                buffer += TELNET_IAC_RE.sub(b'', data)
+                while b'\n' in buffer and not session.closing:
+                    raw, buffer = buffer.split(b'\n', 1)
+                    line = raw.replace(b'\r', b'').replace(b'\0', b'').decode('utf-8', errors='replace').strip()
+                    if session.hung:
+                        continue
+                    if backend.should_hang(line):
+                        # Keep the socket open but never answer again
+                        session.hung = True
+                        continue
+                    await self.reply(writer, session, line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            backend.connections -= 1
+            writer.close()
+
+    async def reply(self, writer, session, line):
+        backend = self.service
+        behaviour = backend.behaviour
+
+        output = backend.execute(session, line)
+        delay = behaviour.latency + (random.uniform(0, behaviour.jitter) if behaviour.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        # The VTY echoes the command line, then prints the output and the next prompt
+        text = line + "\r\n" + ''.join(f"{out}\r\n" for out in output)
+        if not session.closing:
+            text += backend.prompt(session)
+        payload = text.encode('utf-8')
+
+        if behaviour.drip_bytes > 0:
+            for start in range(0, len(payload), behaviour.drip_bytes):
+                writer.write(payload[start:start + behaviour.drip_bytes])
+                await writer.drain()
+                await asyncio.sleep(behaviour.drip_interval / 1000)
+        else:
+            writer.write(payload)
+            await writer.drain()
+
+    async def swallow(self, reader):
+        while await reader.read(4096):
+            pass
+
+
+def load_canned(path):
+    """{service: {command: output}} from a JSON file"""
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+async def serve(args):
+    canned = load_canned(args.canned)
+    overrides = {}
+    for item in args.override or []:
+        service, settings = item.split(':', 1)
+        overrides.setdefault(service, []).append(settings)
+
+    servers = []
+    for service in args.services.split(','):
+        service = service.strip()
+        if service not in SERVICES:
+            raise SystemExit(f"Unknown service: {service} (choose from {', '.join(SERVICES)})")
+
+        behaviour = Behaviour(latency=args.latency, jitter=args.jitter, drip_bytes=args.drip_bytes,
+                              drip_interval=args.drip_interval, hang_rate=args.hang_rate,
+                              hang_match=args.hang_match, hang_banner=args.hang_banner, rows=args.rows)
+        for settings in overrides.get(service, []):
+            behaviour.apply(settings)
+
+        port = SERVICES[service]['port'] + args.port_offset
+        emulated = EmulatedService(service, behaviour, {
+            ' '.join(command.split()): output for command, output in canned.get(service, {}).items()
+        })
+        servers.append(await EmulatorServer(emulated, args.bind, port).start())
+        logger.info(f"{emulated.name} VTY emulator listening on {args.bind}:{port} ({behaviour})")
+
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def main():
+    """Main function with CLI interface"""
+    parser = argparse.ArgumentParser(description='Osmocom VTY emulator (STP/MSC/BSC/HLR/MGW)')
+    parser.add_argument('--services', default=','.join(SERVICES), help='Comma-separated services to emulate')
+    parser.add_argument('--bind', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port-offset', type=int, default=0,
+                        help='Added to the standard VTY ports, e.g. 10000 -> 14239, 14254, ...')
+    parser.add_argument('--rows', type=int, default=10, help='Rows/entries in generated show output')
+    parser.add_argument('--canned', help='JSON file {service: {command: output}} overriding generated output')
+    parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds before each reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra random milliseconds')
+    parser.add_argument('--drip-bytes', type=int, default=0, help='Slow-drip replies in chunks of N bytes')
+    parser.add_argument('--drip-interval', type=float, default=10.0, help='Milliseconds between drip chunks')
+    parser.add_argument('--hang-rate', type=float, default=0.0,
+                        help='Probability that a command hangs its connection (no reply, socket kept open)')
+    parser.add_argument('--hang-match', default='', help='Regex; matching commands hang their connection')
+    parser.add_argument('--hang-banner', action='store_true', help='Accept connections but never send the banner')
+    parser.add_argument('--override', action='append', metavar='SVC:KEY=VALUE[,KEY=VALUE]',
+                        help='Per-service behaviour, e.g. msc:latency=200,hang_rate=0.05 (repeatable)')
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        logger.info("VTY emulator stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,169 +5,1127 @@ HTTP to VTY bridge for Osmocom components
 """
 
 import os
+import re
+import csv
+import gzip
 import json
-import socket
 import time
+import hashlib
+import sqlite3
+import queue
+import uuid
+import bisect
+import asyncio
 import threading
-from flask import Flask, request, jsonify
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
 app = Flask(__name__)
 CORS(app)
 
 # Configuration from environment variables
+VTY_POOL_SIZE = int(os.getenv('VTY_POOL_SIZE', '4'))
+VTY_POOL_IDLE_TIMEOUT = float(os.getenv('VTY_POOL_IDLE_TIMEOUT', '60'))
+VTY_POOL_CHECKOUT_TIMEOUT = float(os.getenv('VTY_POOL_CHECKOUT_TIMEOUT', '10'))
+VTY_BREAKER_FAILURES = int(os.getenv('VTY_BREAKER_FAILURES', '3'))
+VTY_BREAKER_BACKOFF = float(os.getenv('VTY_BREAKER_BACKOFF', '1'))
+VTY_BREAKER_BACKOFF_MAX = float(os.getenv('VTY_BREAKER_BACKOFF_MAX', '60'))
+VTY_FANOUT_DEADLINE = float(os.getenv('VTY_FANOUT_DEADLINE', '3'))
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '2'))
+STATUS_POLL_INTERVAL = float(os.getenv('STATUS_POLL_INTERVAL', '5'))  # 0 disables the poller
+STATUS_SNAPSHOT_TTL = float(os.getenv('STATUS_SNAPSHOT_TTL', '15'))
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', '15'))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '64'))
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '100'))
+HLR_DB_PATH = os.getenv('HLR_DB_PATH', '')  # empty: subscriber reads go through the VTY
+HLR_DB_CONNECTIONS = int(os.getenv('HLR_DB_CONNECTIONS', '4'))
+SUBSCRIBER_PAGE_MAX = int(os.getenv('SUBSCRIBER_PAGE_MAX', '1000'))
+SUBSCRIBER_CACHE_SIZE = int(os.getenv('SUBSCRIBER_CACHE_SIZE', '10000'))
+SUBSCRIBER_CACHE_TTL = float(os.getenv('SUBSCRIBER_CACHE_TTL', '300'))
+SUBSCRIBER_CACHE_NEGATIVE_TTL = float(os.getenv('SUBSCRIBER_CACHE_NEGATIVE_TTL', '30'))
+COMMAND_CACHE_SIZE = int(os.getenv('COMMAND_CACHE_SIZE', '512'))
+COMMAND_CACHE_TTL = float(os.getenv('COMMAND_CACHE_TTL', '5'))  # for 'show' commands no pattern matches
+# ';'-separated "<regex>=<seconds>" rules, matched against the start of the command; 0 disables caching
+COMMAND_CACHE_TTLS = os.getenv('COMMAND_CACHE_TTLS',
+                               'show version=300;show running-config=30;show subscribers=10;show stats=2')
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # bytes
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+SMS_QUEUE_SIZE = int(os.getenv('SMS_QUEUE_SIZE', '1000'))
+SMS_CONCURRENCY = int(os.getenv('SMS_CONCURRENCY', '4'))
+SMS_RATE = float(os.getenv('SMS_RATE', '20'))  # messages/s per MSC, 0 = unlimited
+SMS_BURST = int(os.getenv('SMS_BURST', '20'))
+SMS_JOB_HISTORY = int(os.getenv('SMS_JOB_HISTORY', '10000'))
+
 VTY_HOSTS = {
     'stp': {
         'host': os.getenv('OSMO_STP_HOST', 'osmo-stp'),
         'port': int(os.getenv('OSMO_STP_PORT', '4239')),
-        'name': 'OsmoSTP'
+        'name': 'OsmoSTP',
+        'pool_size': int(os.getenv('OSMO_STP_POOL_SIZE', str(VTY_POOL_SIZE)))
     },
     'msc': {
         'host': os.getenv('OSMO_MSC_HOST', 'osmo-msc'),
         'port': int(os.getenv('OSMO_MSC_PORT', '4254')),
-        'name': 'OsmoMSC'
+        'name': 'OsmoMSC',
+        'pool_size': int(os.getenv('OSMO_MSC_POOL_SIZE', str(VTY_POOL_SIZE)))
     },
     'bsc': {
         'host': os.getenv('OSMO_BSC_HOST', 'osmo-bsc'),
         'port': int(os.getenv('OSMO_BSC_PORT', '4242')),
-        'name': 'OsmoBSC'
+        'name': 'OsmoBSC',
+        'pool_size': int(os.getenv('OSMO_BSC_POOL_SIZE', str(VTY_POOL_SIZE)))
     },
     'hlr': {
         'host': os.getenv('OSMO_HLR_HOST', 'osmo-hlr'),
         'port': int(os.getenv('OSMO_HLR_PORT', '4258')),
-        'name': 'OsmoHLR'
+        'name': 'OsmoHLR',
+        'pool_size': int(os.getenv('OSMO_HLR_POOL_SIZE', str(VTY_POOL_SIZE)))
     },
     'mgw': {
         'host': os.getenv('OSMO_MGW_HOST', 'osmo-mgw'),
         'port': int(os.getenv('OSMO_MGW_PORT', '2427')),
-        'name': 'OsmoMGW'
+        'name': 'OsmoMGW',
+        'pool_size': int(os.getenv('OSMO_MGW_POOL_SIZE', str(VTY_POOL_SIZE)))
     }
 }
 
 
+# Prometheus metrics. A hot-path update is a bisect, a dict lookup and an add,
+# with no lock: VTY metrics are only written from the engine loop, and two
+# request threads racing on the same HTTP series can at worst drop one count.
+# Gauges and counters that already live elsewhere (pool reads, cache hits) are
+# read from their owners at scrape time instead.
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def metric_labels(names, values):
+    """Render a Prometheus label set"""
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def metric_family(name, kind, help_text, samples):
+    """Render a metric family from (label names, label values, value) samples"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for names, values, value in samples:
+        lines.append(f'{name}{metric_labels(names, values)} {value}')
+    return lines
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *values, amount=1):
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        items = sorted(list(self._values.items()))
+        return metric_family(self.name, 'counter', self.help_text,
+                             [(self.labels, values, value) for values, value in items])
+
+
+class Histogram:
+    """Cumulative-bucket histogram; each series is [bucket counts..., +Inf count, sum]"""
+
+    def __init__(self, name, help_text, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *values):
+        series = self._series.get(values)
+        if series is None:
+            series = self._series.setdefault(values, [0] * (len(self.buckets) + 2))
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        items = sorted((values, list(series)) for values, series in list(self._series.items()))
+
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        bucket_labels = self.labels + ('le',)
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{metric_labels(bucket_labels, values + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{metric_labels(self.labels, values)} {series[-1]}')
+            lines.append(f'{self.name}_count{metric_labels(self.labels, values)} {cumulative}')
+        return lines
+
+
+VTY_NUMERIC_RE = re.compile(r'^[\d.:+-]+$')
+
+
+@lru_cache(maxsize=1024)
+def command_family(command):
+    """Metric label for a VTY command: its first two words, minus numeric IDs"""
+    words = [word for word in command.split()[:2] if not VTY_NUMERIC_RE.match(word)]
+    return ' '.join(words) or 'other'
+
+
+HTTP_REQUEST_SECONDS = Histogram('vty_proxy_http_request_duration_seconds',
+                                 'Time to produce an HTTP response, by route',
+                                 ('route', 'method', 'status'))
+VTY_COMMAND_SECONDS = Histogram('vty_proxy_vty_command_duration_seconds',
+                                'VTY command round trip until the prompt, by service and command family',
+                                ('service', 'family'))
+VTY_COALESCED = Counter('vty_proxy_vty_coalesced_total',
+                        'Read-only commands answered by an identical in-flight command',
+                        ('service',))
+VTY_CONNECTS = Counter('vty_proxy_vty_connects_total',
+                       'VTY sessions opened (initial connects and reconnects)',
+                       ('service', 'result'))
+
+
+# Any VTY prompt at the very end of the buffer: "<hostname>[(<node>)]> " or "...# ".
+# Only the tail of the buffer is scanned, never the whole response.
+VTY_PROMPT_RE = re.compile(rb'(?:^|[\r\n])([A-Za-z0-9._-]+)(?:\(([A-Za-z0-9._-]+)\))?([>#]) ?$')
+VTY_PROMPT_TAIL = 128
+
+
+class VTYProtocol(asyncio.Protocol):
+    """Accumulates VTY output in a bytearray and signals when a prompt arrives.
+
+    The hostname is learned from the prompt that ends the welcome banner;
+    after that only prompts carrying that hostname terminate a read, in
+    whatever node (view, enable, config...) the session is in.
+    """
+
+    def __init__(self, hostname=None):
+        self.transport = None
+        self.buffer = bytearray()
+        self.closed = False
+        self.hostname = hostname
+        self.expect_rename = False
+        self.prompt = None
+        self.prompts = []  # (match, arrival) of each prompt seen while pipelining
+        self._expected = 0
+        self._scan_pos = 0
+        self._waiter = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        if self._waiter is None or self._waiter.done():
+            return
+        if self._expected:
+            if self._scan_prompts() >= self._expected:
+                self._waiter.set_result('prompt')
+        elif self.find_prompt():
+            self._waiter.set_result('prompt')
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result('eof')
+
+    def find_prompt(self):
+        """Match a prompt at the end of the buffer, remembering it in self.prompt"""
+        match = VTY_PROMPT_RE.search(self.buffer, max(0, len(self.buffer) - VTY_PROMPT_TAIL))
+        if match is None:
+            return None
+
+        hostname = match.group(1).decode('ascii')
+        if self.hostname is not None and hostname != self.hostname and not self.expect_rename:
+            return None
+
+        self.hostname = hostname
+        self.expect_rename = False
+        self.prompt = match
+        return match
+
+    async def wait_for_prompt(self, timeout):
+        """Wait until a prompt ends the buffer; returns 'prompt', 'timeout' or 'eof'"""
+        self.prompt = None
+        if self.find_prompt():
+            return 'prompt'
+        if self.closed:
+            return 'eof'
+        return await self._wait(timeout)
+
+    async def wait_for_prompts(self, count, timeout):
+        """Wait until count prompts have arrived, collecting them in self.prompts"""
+        self.prompts = []
+        self._scan_pos = 0
+        self._expected = count
+        self._inline_prompt_re = re.compile(
+            rb'(?:^|[\r\n])(' + re.escape(self.hostname.encode('ascii')) + rb')(?:\(([A-Za-z0-9._-]+)\))?([>#]) ?')
+        try:
+            if self._scan_prompts() >= count:
+                return 'prompt'
+            if self.closed:
+                return 'eof'
+            return await self._wait(timeout)
+        finally:
+            self._expected = 0
+
+    def _scan_prompts(self):
+        # Only look at data that arrived since the last scan (plus room for a split prompt)
+        last_end = self.prompts[-1][0].end() if self.prompts else 0
+        for match in self._inline_prompt_re.finditer(self.buffer, max(0, self._scan_pos - VTY_PROMPT_TAIL)):
+            if match.start(1) >= last_end and len(self.prompts) < self._expected:
+                self.prompts.append((match, time.perf_counter()))
+                last_end = match.end()
+        self._scan_pos = len(self.buffer)
+        return len(self.prompts)
+
+    async def _wait(self, timeout):
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(self._waiter, timeout)
+        except asyncio.TimeoutError:
+            return 'timeout'
+        finally:
+            self._waiter = None
+
+
+def vty_node(prompt):
+    """Map a matched prompt to the VTY node it represents"""
+    if prompt.group(2):
+        return prompt.group(2).decode('ascii')
+    return 'enable' if prompt.group(3) == b'#' else 'view'
+
+
+def clean_response(response, command, framed):
+    """Strip the command echo (and, after a timeout, any stray prompt) from a reply"""
+    cleaned_lines = []
+    for line in response.split('\n'):
+        line = line.strip()
+        if line and line != command and (framed or not line.endswith(('>', '#'))):
+            cleaned_lines.append(line)
+    return '\n'.join(cleaned_lines)
+
+
+def vty_error(result):
+    """The VTY's own error message ('% ...') in a result, if any"""
+    if not result.get('success'):
+        return result.get('error', 'Command failed')
+    for line in result.get('output', '').split('\n'):
+        if line.startswith('%'):
+            return line
+    return None
+
+
 class VTYConnection:
-    def __init__(self, host, port, timeout=5):
+    """Asyncio VTY client; must only be used from the engine's event loop"""
+
+    def __init__(self, host, port, timeout=5, hostname=None, reads=None, service=None, breaker=None):
         self.host = host
         self.port = port
+        self.service = service or f'{host}:{port}'
+        self.breaker = breaker
         self.timeout = timeout
-        self.socket = None
+        self.transport = None
+        self.protocol = None
         self.connected = False
+        self.hostname = hostname
+        self.node = None
+        # How reads ended, shared with the owning pool
+        self.reads = reads if reads is not None else {'prompt': 0, 'timeout': 0, 'eof': 0}
 
-    def connect(self):
-        """Establish VTY connection"""
+    async def connect(self):
+        """Establish VTY connection and learn the prompt from the banner"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(self.timeout)
-            self.socket.connect((self.host, self.port))
-
-            # Read welcome message
-            welcome = self.socket.recv(1024).decode('utf-8', errors='ignore')
+            loop = asyncio.get_running_loop()
+            self.transport, self.protocol = await asyncio.wait_for(
+                loop.create_connection(lambda: VTYProtocol(self.hostname), self.host, self.port),
+                self.timeout)
+
+            # Read welcome message up to the first prompt
+            outcome = await self.protocol.wait_for_prompt(self.timeout)
+            self.reads[outcome] += 1
+            if outcome == 'eof':
+                raise ConnectionError("connection closed during welcome banner")
+            self._track_prompt()
+            self.protocol.buffer.clear()
             self.connected = True
+            VTY_CONNECTS.inc(self.service, 'ok')
+            self._record(True)
             return True
+        except asyncio.CancelledError:
+            self.disconnect()
+            raise
         except Exception as e:
             print(f"Failed to connect to {self.host}:{self.port}: {e}")
-            self.connected = False
+            VTY_CONNECTS.inc(self.service, 'failed')
+            self._record(False)
+            self.disconnect()
             return False
 
-    def send_command(self, command):
+    async def send_command(self, command):
         """Send command and get response"""
         if not self.connected:
-            if not self.connect():
+            if not await self.connect():
                 return {"error": f"Cannot connect to {self.host}:{self.port}"}
 
         try:
             # Send command
-            self.socket.send(f"{command}\n".encode('utf-8'))
+            mutating = not is_read_only(command)
+            if mutating:
+                command_cache.invalidate(self.service)
+            self.protocol.buffer.clear()
+            self.protocol.expect_rename = command.split()[:1] == ['hostname'] or \
+                command.split()[:2] == ['no', 'hostname']
+            started = time.perf_counter()
+            self.transport.write(f"{command}\n".encode('utf-8'))
+
+            # Read response until the prompt, EOF or timeout
+            outcome = await self.protocol.wait_for_prompt(self.timeout)
+            VTY_COMMAND_SECONDS.observe(time.perf_counter() - started, self.service, command_family(command))
+            self.reads[outcome] += 1
+            self._record(outcome == 'prompt')
+            if mutating:
+                command_cache.invalidate(self.service)
+            if outcome == 'timeout':
+                # The reply may still arrive and would be read as the next command's
+                self.disconnect()
+                return {"error": "Command timed out", "success": False}
+            if outcome == 'eof':
+                self.connected = False
+
+            # Decode once the whole response is framed, without the prompt
+            prompt = self.protocol.prompt if outcome == 'prompt' else None
+            end = prompt.start(1) if prompt else len(self.protocol.buffer)
+            response = self.protocol.buffer[:end].decode('utf-8', errors='ignore')
+            self.protocol.buffer.clear()
+            self._track_prompt()
+
+            return {"output": clean_response(response, command, prompt is not None), "success": True}
+
+        except asyncio.CancelledError:
+            # The reply is still in flight; the session cannot be reused
+            self.disconnect()
+            raise
+        except Exception as e:
+            self.disconnect()
+            return {"error": str(e), "success": False}
 
-            # Read response
-            response = ""
-            while True:
-                try:
-                    data = self.socket.recv(4096).decode('utf-8', errors='ignore')
-                    if not data:
-                        break
-                    response += data
-
-                    # Check for command prompt or timeout
-                    if "OpenBSC>" in response or "OsmoMSC>" in response or "OsmoSTP>" in response or "OsmoHLR>" in response or "OsmoMGW>" in response:
-                        break
-                except socket.timeout:
-                    break
-
-            # Clean up response
-            lines = response.split('\n')
-            # Remove command echo and prompt
-            cleaned_lines = []
-            for line in lines:
-                line = line.strip()
-                if line and not line.endswith('>') and line != command:
-                    cleaned_lines.append(line)
-
-            return {"output": '\n'.join(cleaned_lines), "success": True}
+    async def send_pipelined(self, commands):
+        """Write all commands at once and split the replies on their prompts.
+
+        Returns one (result, elapsed) pair per command; elapsed is the
+        time between the previous prompt and this command's prompt.
+        """
+        if not self.connected:
+            if not await self.connect():
+                return [({"error": f"Cannot connect to {self.host}:{self.port}"}, 0.0)] * len(commands)
 
+        try:
+            mutating = not all(is_read_only(command) for command in commands)
+            if mutating:
+                command_cache.invalidate(self.service)
+            self.protocol.buffer.clear()
+            started = time.perf_counter()
+            self.transport.write(''.join(f"{command}\n" for command in commands).encode('utf-8'))
+
+            outcome = await self.protocol.wait_for_prompts(len(commands), self.timeout * len(commands))
+            self.reads['prompt'] += len(self.protocol.prompts)
+            self._record(outcome == 'prompt')
+            if mutating:
+                command_cache.invalidate(self.service)
+            if outcome != 'prompt':
+                self.reads[outcome] += 1
+                # Replies for the missing commands may still arrive; do not reuse the session
+                self.disconnect()
+
+            results = []
+            start, previous = 0, started
+            for command, (prompt, arrival) in zip(commands, self.protocol.prompts):
+                response = self.protocol.buffer[start:prompt.start(1)].decode('utf-8', errors='ignore')
+                results.append(({"output": clean_response(response, command, True), "success": True},
+                                arrival - previous))
+                VTY_COMMAND_SECONDS.observe(arrival - previous, self.service, command_family(command))
+                start, previous = prompt.end(), arrival
+
+            for command in commands[len(results):]:
+                results.append(({"error": f"No response ({outcome})", "success": False}, 0.0))
+
+            if self.protocol.prompts:
+                self.protocol.prompt = self.protocol.prompts[-1][0]
+                self._track_prompt()
+            self.protocol.buffer.clear()
+            return results
+
+        except asyncio.CancelledError:
+            self.disconnect()
+            raise
         except Exception as e:
-            self.connected = False
-            return {"error": str(e), "success": False}
+            self.disconnect()
+            return [({"error": str(e), "success": False}, 0.0)] * len(commands)
+
+    def _record(self, ok):
+        if self.breaker is not None:
+            self.breaker.record(ok)
+
+    def _track_prompt(self):
+        if self.protocol.prompt:
+            self.hostname = self.protocol.hostname
+            self.node = vty_node(self.protocol.prompt)
+
+    def is_alive(self):
+        """Check that an idle connection is still usable"""
+        if not self.connected or self.protocol.closed or self.transport.is_closing():
+            return False
+
+        # Drop stale output left behind by an earlier timed-out command
+        self.protocol.buffer.clear()
+        return True
 
     def disconnect(self):
         """Close VTY connection"""
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
+        if self.transport:
+            self.transport.close()
         self.connected = False
 
 
-# Global VTY connections
-vty_connections = {}
+class VTYUnavailable(Exception):
+    """A VTY backend cannot take a command right now; answered with a 503"""
 
+    status = 'unavailable'
+    retry_after = None
 
-def get_vty_connection(service):
-    """Get or create VTY connection for service"""
-    if service not in vty_connections:
-        if service not in VTY_HOSTS:
-            return None
 
-        host_info = VTY_HOSTS[service]
-        vty_connections[service] = VTYConnection(host_info['host'], host_info['port'])
+class VTYPoolTimeout(VTYUnavailable):
+    """Raised when no pooled VTY session becomes free in time"""
+
+    status = 'pool_exhausted'
+
+
+class VTYCircuitOpen(VTYUnavailable):
+    """Raised instead of contacting a backend whose circuit is open"""
+
+    status = 'circuit_open'
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker for one VTY backend.
+
+    Consecutive failures (connect errors, read timeouts, EOF) open the
+    circuit and checkouts then fail fast. Once the backoff has passed a
+    single trial request is let through: its success closes the circuit,
+    its failure reopens it with the backoff doubled, up to backoff_max.
+    """
+
+    def __init__(self, threshold=VTY_BREAKER_FAILURES, backoff=VTY_BREAKER_BACKOFF,
+                 backoff_max=VTY_BREAKER_BACKOFF_MAX, name=None):
+        self.threshold = max(1, threshold)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.name = name
+        self.state = 'closed'
+        self.failures = 0
+        self.reopens = 0   # consecutive opens, drives the backoff
+        self.opened = 0    # total opens since start
+        self.retry_at = 0.0
+        self.trial = False
+
+    def allow(self):
+        """Whether a request may contact the backend now"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if time.monotonic() < self.retry_at:
+                return False
+            self.state = 'half_open'
+            self.trial = False
+        if self.trial:
+            return False
+        self.trial = True
+        return True
+
+    def record(self, ok):
+        if ok:
+            if self.state != 'closed':
+                print(f"Circuit for {self.name} closed")
+            self.state = 'closed'
+            self.failures = 0
+            self.reopens = 0
+            self.trial = False
+        elif self.state != 'open':
+            # Late failures from requests started before the circuit opened are ignored
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                self._open()
+
+    def end_trial(self):
+        """A half-open trial finished without reaching the backend; allow another"""
+        if self.state == 'half_open':
+            self.trial = False
+
+    def retry_after(self):
+        return max(0.0, self.retry_at - time.monotonic()) if self.state == 'open' else 0.0
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures, 'opened': self.opened,
+                'retry_after': round(self.retry_after(), 3)}
+
+    def _open(self):
+        delay = min(self.backoff * 2 ** self.reopens, self.backoff_max)
+        self.reopens += 1
+        self.opened += 1
+        self.state = 'open'
+        self.trial = False
+        self.retry_at = time.monotonic() + delay
+        print(f"Circuit for {self.name} open; retrying in {delay:.1f}s")
+
+
+class VTYPool:
+    """Bounded pool of VTY sessions for a single service; lives on the engine loop"""
+
+    def __init__(self, host, port, size=VTY_POOL_SIZE, idle_timeout=VTY_POOL_IDLE_TIMEOUT,
+                 checkout_timeout=VTY_POOL_CHECKOUT_TIMEOUT, service=None):
+        self.host = host
+        self.port = port
+        self.service = service
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.in_use = 0
+        self.hostname = None
+        self.reads = {'prompt': 0, 'timeout': 0, 'eof': 0}
+        self.breaker = CircuitBreaker(name=service or f'{host}:{port}')
+        self._slots = asyncio.Semaphore(size)
+        self._idle = deque()  # (VTYConnection, last_used), oldest on the left
+
+    async def checkout(self):
+        """Take a session from the pool, opening a new one if none is idle"""
+        if not self.breaker.allow():
+            retry_after = self.breaker.retry_after()
+            raise VTYCircuitOpen(f"Circuit open for {self.host}:{self.port}; "
+                                 f"retry in {retry_after:.1f}s", round(retry_after, 3))
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.end_trial()
+            raise VTYPoolTimeout(f"No free VTY session for {self.host}:{self.port} "
+                                 f"after {self.checkout_timeout}s")
+
+        try:
+            vty = self._take_idle()
+            if vty is None:
+                vty = VTYConnection(self.host, self.port, hostname=self.hostname, reads=self.reads,
+                                    service=self.service, breaker=self.breaker)
+                # connect() has already counted the failure against the breaker
+                if not await vty.connect():
+                    raise VTYUnavailable(f"Cannot connect to {self.host}:{self.port}")
+                self.hostname = vty.hostname or self.hostname
+        except BaseException:
+            self.breaker.end_trial()
+            self._slots.release()
+            raise
+
+        self.in_use += 1
+        return vty
+
+    def checkin(self, vty):
+        """Return a session to the pool; broken sessions are discarded.
+
+        So are sessions left outside the view node (after 'enable' or
+        'configure terminal'): the next caller expects a fresh session.
+        """
+        self.in_use -= 1
+        self.breaker.end_trial()
+        if vty.hostname:
+            self.hostname = vty.hostname
+        if vty.connected and vty.node in (None, 'view'):
+            self._idle.append((vty, time.monotonic()))
+        else:
+            vty.disconnect()
+        self.evict_idle()
+        self._slots.release()
+
+    @asynccontextmanager
+    async def session(self):
+        """Check out a session for the duration of an async with-block"""
+        vty = await self.checkout()
+        try:
+            yield vty
+        finally:
+            self.checkin(vty)
+
+    def evict_idle(self):
+        """Close sessions that have been idle longer than idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            vty, _ = self._idle.popleft()
+            vty.disconnect()
+
+    def close(self):
+        """Close all idle sessions"""
+        while self._idle:
+            vty, _ = self._idle.popleft()
+            vty.disconnect()
+
+    def stats(self):
+        return {'size': self.size, 'in_use': self.in_use, 'idle': len(self._idle),
+                'hostname': self.hostname, 'reads': dict(self.reads), 'circuit': self.breaker.stats()}
+
+    def _take_idle(self):
+        # LIFO keeps the hottest sessions busy and lets cold ones age out
+        self.evict_idle()
+        while self._idle:
+            vty, _ = self._idle.pop()
+            if vty.is_alive():
+                # Another session may have renamed the node since this one was used
+                vty.protocol.hostname = self.hostname or vty.protocol.hostname
+                return vty
+            vty.disconnect()
+        return None
+
+
+class VTYEngine:
+    """Runs the asyncio VTY client on one background event loop thread.
+
+    Flask request threads hand coroutines to the loop and wait on the
+    result; all backend socket I/O is multiplexed on the loop itself.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self._run, name='vty-engine', daemon=True).start()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop, returning a concurrent Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine loop and block for its result"""
+        return self.submit(coro).result(timeout)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(reap_idle_sessions())
+        self.loop.create_task(probe_sms_formats())
+        sms_queue.start(self.loop)
+        if STATUS_POLL_INTERVAL > 0:
+            self.loop.create_task(status_collector.run())
+        self.loop.run_forever()
+
+
+# Structured parsers for VTY show output, keyed by command pattern
+VTY_PARSERS = []
+PARSE_CACHE_SIZE = int(os.getenv('PARSE_CACHE_SIZE', '256'))
+
+VTY_COUNTER_RE = re.compile(r'^(?P<name>[^:]+):\s+(?P<value>-?\d+)(?:\s+\((?P<rates>[^)]*)\))?$')
+VTY_RATE_RE = re.compile(r'(-?\d+)/([smhd])')
+VTY_BTS_RE = re.compile(r'^BTS (?P<nr>\d+) is of (?P<type>\S+) type in band (?P<band>\S+), '
+                        r'has CI (?P<ci>\d+) LAC (?P<lac>\d+), BSIC (?P<bsic>\d+).*?and (?P<num_trx>\d+) TRX')
+
+
+def vty_parser(pattern):
+    """Register a parser for commands matching pattern"""
+    def register(parser):
+        VTY_PARSERS.append((re.compile(pattern), parser))
+        return parser
+    return register
+
+
+def typed(value):
+    """Convert a VTY field to int/float where it looks numeric"""
+    value = value.strip()
+    if not value:
+        return None
+    # Leading zeros mean an identifier (IMSI, MSISDN...), not a number
+    if re.fullmatch(r'-?(0|[1-9]\d*)', value):
+        return int(value)
+    if re.fullmatch(r'-?\d+\.\d+', value):
+        return float(value)
+    return value
+
+
+def field_name(header):
+    return re.sub(r'[^a-z0-9]+', '_', header.lower()).strip('_')
+
+
+def parse_table(output, text_fields=()):
+    """Parse a fixed-width table whose header is underlined with dashes.
+
+    Column boundaries are taken from the runs of dashes, so header
+    names and cells may contain spaces. Columns in text_fields are
+    never converted to numbers.
+    """
+    lines = output.split('\n')
+    for i, line in enumerate(lines):
+        if i == 0 or not re.fullmatch(r'-+(\s+-+)*', line):
+            continue
+
+        spans = [m.span() for m in re.finditer(r'-+', line)]
+        # Extend each column up to the next one so wider cells are not cut
+        bounds = [(start, spans[n + 1][0] if n + 1 < len(spans) else None)
+                  for n, (start, _) in enumerate(spans)]
+        header = [field_name(lines[i - 1][start:end]) or f'col{n}' for n, (start, end) in enumerate(bounds)]
+
+        rows = []
+        for row in lines[i + 1:]:
+            if not row.strip():
+                break
+            rows.append({
+                name: (row[start:end].strip() or None) if name in text_fields else typed(row[start:end])
+                for name, (start, end) in zip(header, bounds)
+            })
+        return rows
+    return []
+
+
+def parse_counters(output):
+    """Parse rate counter / stat item groups into {group: {counter: value}}"""
+    groups = {}
+    current = groups.setdefault('ungrouped', {})
+    for line in output.split('\n'):
+        match = VTY_COUNTER_RE.match(line)
+        if match:
+            counter = {'value': int(match.group('value'))}
+            if match.group('rates'):
+                counter['rates'] = {unit: int(n) for n, unit in VTY_RATE_RE.findall(match.group('rates'))}
+            current[match.group('name').strip()] = counter
+        elif line.endswith(':'):
+            current = groups.setdefault(line[:-1].strip(), {})
+    return {group: counters for group, counters in groups.items() if counters}
+
+
+@vty_parser(r'^show cs7 instance \d+ asp$')
+def parse_asp(output):
+    return {'asps': parse_table(output)}
+
+
+@vty_parser(r'^show cs7 instance \d+ as all$')
+def parse_as(output):
+    return {'ases': parse_table(output)}
+
+
+@vty_parser(r'^show subscribers( all)?$')
+def parse_subscribers(output):
+    return {'subscribers': parse_table(output, text_fields=('msisdn', 'imsi', 'imei'))}
+
+
+@vty_parser(r'^show (stats|mgcp stats)$')
+def parse_stats(output):
+    return {'groups': parse_counters(output)}
+
+
+@vty_parser(r'^show bts( \d+)?$')
+def parse_bts(output):
+    bts_list = []
+    for line in output.split('\n'):
+        match = VTY_BTS_RE.match(line)
+        if match:
+            bts_list.append({key: typed(value) for key, value in match.groupdict().items()})
+        elif bts_list and ':' in line:
+            key, value = line.split(':', 1)
+            bts_list[-1][field_name(key)] = typed(value)
+    return {'bts': bts_list}
+
+
+class ParseCache:
+    """LRU of parse results keyed by parser and a hash of the raw output"""
+
+    def __init__(self, size=PARSE_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, parser, output):
+        key = (parser.__name__, hashlib.blake2b(output.encode('utf-8'), digest_size=16).digest())
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        parsed = parser(output)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = parsed
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return parsed
+
+
+parse_cache = ParseCache()
+
+
+def parse_output(command, output):
+    """Structured form of a command's output, or None if no parser is registered"""
+    command = normalize_command(command)
+    for pattern, parser in VTY_PARSERS:
+        if pattern.match(command):
+            try:
+                return parse_cache.parse(parser, output)
+            except Exception as e:
+                print(f"Parser {parser.__name__} failed for '{command}': {e}")
+                return None
+    return None
+
+
+def annotate(command, result):
+    """Attach the parsed form to a successful command result"""
+    if result.get('success'):
+        parsed = parse_output(command, result.get('output', ''))
+        if parsed is not None:
+            result['parsed'] = parsed
+    return result
+
+
+# Per-service VTY session pools
+vty_pools = {
+    service: VTYPool(host_info['host'], host_info['port'], size=host_info['pool_size'], service=service)
+    for service, host_info in VTY_HOSTS.items()
+}
 
-    return vty_connections[service]
+vty_engine = VTYEngine()
+
+
+def get_vty_pool(service):
+    """Get the VTY session pool for service"""
+    return vty_pools.get(service)
+
+
+def parse_ttl_rules(spec):
+    """Parse "<regex>=<seconds>;..." into [(compiled regex, seconds)]"""
+    rules = []
+    for item in spec.split(';'):
+        if item.strip():
+            pattern, ttl = item.rsplit('=', 1)
+            rules.append((re.compile(pattern.strip()), float(ttl)))
+    return rules
+
+
+class CommandCache:
+    """Size-bounded LRU of read-only command results per (service, command).
+
+    TTLs come from the first matching rule. Any non-'show' command sent to a
+    service bumps that service's generation: older entries stop matching,
+    and replies to commands that were already in flight are not stored.
+    """
+
+    def __init__(self, size=COMMAND_CACHE_SIZE, ttl=COMMAND_CACHE_TTL, rules=COMMAND_CACHE_TTLS):
+        self.size = size
+        self.ttl = ttl
+        self.rules = parse_ttl_rules(rules)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generations = {}      # service -> int
+        self.invalidated_at = {}   # service -> wall time of the last invalidation
+        self._entries = OrderedDict()  # (service, command) -> (result, stored_at, expires, generation)
+        self._lock = threading.Lock()
+
+    def ttl_for(self, command):
+        for pattern, ttl in self.rules:
+            if pattern.match(command):
+                return ttl
+        return self.ttl
+
+    def generation(self, service):
+        return self.generations.get(service, 0)
+
+    def get(self, service, command):
+        """Cached (result, age) for a read-only command, or None"""
+        key = (service, normalize_command(command))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic() or entry[3] != self.generation(service):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[0], time.time() - entry[1]
+
+    def put(self, service, command, result, generation):
+        """Store a successful result unless the service was invalidated since generation"""
+        command = normalize_command(command)
+        ttl = self.ttl_for(command)
+        if ttl <= 0 or vty_error(result):
+            return
+        with self._lock:
+            if generation != self.generation(service):
+                return
+            self._entries[(service, command)] = (result, time.time(), time.monotonic() + ttl, generation)
+            self._entries.move_to_end((service, command))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, service):
+        with self._lock:
+            self.generations[service] = self.generation(service) + 1
+            self.invalidated_at[service] = time.time()
+            self.invalidations += 1
+
+    def stats(self):
+        return {'size': len(self._entries), 'max_size': self.size, 'hits': self.hits,
+                'misses': self.misses, 'invalidations': self.invalidations}
+
+
+command_cache = CommandCache()
+
+
+def cache_bypassed(data):
+    """Whether a request asked to skip cached results (Cache-Control: no-cache or "cache": "no-cache")"""
+    directives = {part.strip().lower() for part in request.headers.get('Cache-Control', '').split(',')}
+    return bool(directives & {'no-cache', 'no-store', 'max-age=0'}) or \
+        str(data.get('cache', '')).lower() in ('no-cache', 'no-store', 'bypass')
+
+
+class SingleFlight:
+    """Collapses concurrent identical read-only commands into one VTY round trip.
+
+    The first caller for a (service, command) key runs it; callers that
+    arrive while it is in flight wait for the same result. A waiter that
+    is cancelled does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.collapsed = 0
+        self._inflight = {}  # (service, command) -> Future
+
+    async def run(self, key, factory):
+        future = self._inflight.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.collapsed += 1
+            VTY_COALESCED.inc(key[0])
+        # Each caller gets its own copy of the shared result
+        return dict(await asyncio.shield(future))
+
+    def stats(self):
+        return {'leaders': self.leaders, 'collapsed': self.collapsed, 'inflight': len(self._inflight)}
+
+
+vty_single_flight = SingleFlight()
+
+
+async def vty_command(service, command):
+    """Run one command on a pooled session of service; identical concurrent 'show's share a reply"""
+    async def execute():
+        async with vty_pools[service].session() as vty:
+            return annotate(command, await vty.send_command(command))
+
+    if not is_read_only(command):
+        return await execute()
+    generation = command_cache.generation(service)
+    result = await vty_single_flight.run((service, normalize_command(command)), execute)
+    command_cache.put(service, command, result, generation)
+    return result
+
+
+def run_vty_command(service, command):
+    """Run one command from a request thread"""
+    return vty_engine.run(vty_command(service, command))
+
+
+async def reap_idle_sessions():
+    """Periodically evict idle sessions from all pools"""
+    while True:
+        await asyncio.sleep(max(1.0, VTY_POOL_IDLE_TIMEOUT / 2))
+        for pool in vty_pools.values():
+            pool.evict_idle()
+
+
+async def fan_out(collect, services=None, deadline=VTY_FANOUT_DEADLINE):
+    """Run collect(service, result) for all services concurrently.
+
+    Each service gets its own deadline; a service that misses it keeps
+    whatever collect() had already put into its result dict and is
+    marked with 'timed_out'.
+    """
+    services = list(services or VTY_HOSTS.keys())
+    results = {service: {} for service in services}
+
+    async def bounded(service):
+        try:
+            await asyncio.wait_for(collect(service, results[service]), deadline)
+            results[service]['timed_out'] = False
+        except asyncio.TimeoutError:
+            results[service]['timed_out'] = True
+            results[service].setdefault('error', f'No response within {deadline}s')
+        except VTYUnavailable as e:
+            results[service].update({'timed_out': False, 'error': str(e), 'status': e.status})
+
+    await asyncio.gather(*(bounded(service) for service in services))
+    return results
+
+
+async def close_pools():
+    for pool in vty_pools.values():
+        pool.close()
+
+
+async def probe_service(service, result):
+    """Check that the service's VTY port accepts TCP connections"""
+    host_info = VTY_HOSTS[service]
+    try:
+        _, writer = await asyncio.open_connection(host_info['host'], host_info['port'])
+        writer.close()
+        result['healthy'] = True
+    except OSError as e:
+        result['healthy'] = False
+        result['error'] = str(e)
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    status = {}
     overall_health = True
 
-    for service, host_info in VTY_HOSTS.items():
-        try:
-            # Quick TCP connection test
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(2)
-            result = sock.connect_ex((host_info['host'], host_info['port']))
-            sock.close()
-
-            is_healthy = result == 0
-            status[service] = {
-                'healthy': is_healthy,
-                'host': host_info['host'],
-                'port': host_info['port'],
-                'name': host_info['name']
-            }
-
-            if not is_healthy:
-                overall_health = False
+    # Quick TCP connection test against all services at once
+    status = vty_engine.run(fan_out(probe_service, deadline=HEALTH_CHECK_TIMEOUT))
+    for service, service_status in status.items():
+        host_info = VTY_HOSTS[service]
+        service_status.setdefault('healthy', False)
+        service_status.update({
+            'host': host_info['host'],
+            'port': host_info['port'],
+            'name': host_info['name'],
+            'circuit': vty_pools[service].breaker.state
+        })
 
-        except Exception as e:
-            status[service] = {
-                'healthy': False,
-                'error': str(e),
-                'host': host_info['host'],
-                'port': host_info['port'],
-                'name': host_info['name']
-            }
+        if not service_status['healthy']:
             overall_health = False
 
     return jsonify({
@@ -186,12 +1144,25 @@ def list_services():
             'id': service,
             'name': host_info['name'],
             'host': host_info['host'],
-            'port': host_info['port']
+            'port': host_info['port'],
+            'pool': vty_pools[service].stats()
         })
 
     return jsonify({'services': services})
 
 
+@app.route('/api/caches', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the proxy's caches"""
+    return jsonify({
+        'subscribers': subscriber_cache.stats(),
+        'parsed_output': {'size': len(parse_cache._entries), 'hits': parse_cache.hits, 'misses': parse_cache.misses},
+        'commands': command_cache.stats(),
+        'coalesced_commands': vty_single_flight.stats(),
+        'timestamp': time.time()
+    })
+
+
 @app.route('/api/command', methods=['POST'])
 def execute_command():
     """Execute VTY command on specified service"""
@@ -206,81 +1177,754 @@ def execute_command():
         if not command:
             return jsonify({'error': 'No command provided'}), 400
 
-        # Get VTY connection
-        vty = get_vty_connection(service)
-        if not vty:
+        # Get VTY session pool
+        pool = get_vty_pool(service)
+        if not pool:
             return jsonify({'error': f'Unknown service: {service}'}), 400
 
-        # Execute command
-        result = vty.send_command(command)
+        # Read-only commands are served from the poller's snapshot or the command cache,
+        # unless the caller bypasses them or the service was changed after the snapshot
+        cached = None
+        if is_read_only(command) and not cache_bypassed(data):
+            cached = status_collector.lookup(service, command)
+            if cached and time.time() - cached[1] < command_cache.invalidated_at.get(service, 0):
+                cached = None
+            cached = cached or command_cache.get(service, command)
+        if cached:
+            result, age = cached
+            return jsonify({
+                'service': service,
+                'command': command,
+                'result': result,
+                'cached': True,
+                'age': round(age, 3),
+                'timestamp': time.time()
+            })
+
+        # Execute command on a session of our own
+        result = run_vty_command(service, command)
 
         return jsonify({
             'service': service,
             'command': command,
             'result': result,
+            'cached': False,
             'timestamp': time.time()
         })
 
+    except VTYUnavailable as e:
+        return vty_unavailable(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/status', methods=['GET'])
-def get_status():
-    """Get comprehensive status from all services"""
-    status = {}
-
-    # Common status commands for each service
-    status_commands = {
-        'stp': [
-            'show cs7 instance 0 users',
-            'show cs7 instance 0 asp',
-            'show cs7 instance 0 as all'
-        ],
-        'msc': [
-            'show subscribers',
-            'show calls',
-            'show sms queue',
-            'show stats'
-        ],
-        'bsc': [
-            'show bts',
-            'show trx',
-            'show paging'
-        ],
-        'hlr': [
-            'show subscribers',
-            'show stats'
-        ],
-        'mgw': [
-            'show mgcp stats',
-            'show stats'
-        ]
-    }
+# Common status commands for each service
+STATUS_COMMANDS = {
+    'stp': [
+        'show cs7 instance 0 users',
+        'show cs7 instance 0 asp',
+        'show cs7 instance 0 as all'
+    ],
+    'msc': [
+        'show subscribers',
+        'show calls',
+        'show sms queue',
+        'show stats'
+    ],
+    'bsc': [
+        'show bts',
+        'show trx',
+        'show paging'
+    ],
+    'hlr': [
+        'show subscribers',
+        'show stats'
+    ],
+    'mgw': [
+        'show mgcp stats',
+        'show stats'
+    ]
+}
+
+
+def normalize_command(command):
+    """Collapse whitespace so equivalent commands share cache entries"""
+    return ' '.join(command.split())
+
+
+def is_read_only(command):
+    return command.split()[:1] == ['show']
+
 
-    for service in VTY_HOSTS.keys():
-        service_status = {'connected': False, 'data': {}}
+BATCH_MAX_COMMANDS = int(os.getenv('BATCH_MAX_COMMANDS', '100'))
 
-        vty = get_vty_connection(service)
-        if vty and vty.connect():
+
+async def run_batch(service, commands, stop_on_error):
+    """Run a service's share of a batch over one session.
+
+    Commands are pipelined unless the caller wants to stop at the first
+    error, in which case each command waits for the previous reply.
+    """
+    async with vty_pools[service].session() as vty:
+        renames = any(cmd.split()[:1] == ['hostname'] or cmd.split()[:2] == ['no', 'hostname'] for cmd in commands)
+        if not stop_on_error and not renames and vty.connected and vty.hostname:
+            results = await vty.send_pipelined(commands)
+            return [(annotate(cmd, result), elapsed) for cmd, (result, elapsed) in zip(commands, results)]
+
+        results = []
+        for cmd in commands:
+            started = time.perf_counter()
+            result = annotate(cmd, await vty.send_command(cmd))
+            results.append((result, time.perf_counter() - started))
+            if stop_on_error and vty_error(result):
+                break
+        return results
+
+
+@app.route('/api/command/batch', methods=['POST'])
+def execute_batch():
+    """Execute an ordered list of VTY commands on one or more services"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        default_service = data.get('service', 'stp')
+        stop_on_error = bool(data.get('stop_on_error', False))
+        commands = data.get('commands') or []
+
+        if not commands:
+            return jsonify({'error': 'No commands provided'}), 400
+        if len(commands) > BATCH_MAX_COMMANDS:
+            return jsonify({'error': f'At most {BATCH_MAX_COMMANDS} commands per batch'}), 400
+
+        # Items are plain strings for the default service or {"service", "command"}
+        items = []
+        for item in commands:
+            if isinstance(item, str):
+                item = {'service': default_service, 'command': item}
+            service, command = item.get('service', default_service), item.get('command', '')
+            if service not in VTY_HOSTS:
+                return jsonify({'error': f'Unknown service: {service}'}), 400
+            if not command:
+                return jsonify({'error': 'Empty command in batch'}), 400
+            items.append((service, command))
+
+        by_service = {}
+        for service, command in items:
+            by_service.setdefault(service, []).append(command)
+
+        async def run_service(service):
+            try:
+                return await run_batch(service, by_service[service], stop_on_error)
+            except VTYUnavailable as e:
+                # Fail only this service's commands; the others still run
+                failure = {'error': str(e), 'success': False, 'status': e.status}
+                return [(failure, 0.0)] * len(by_service[service])
+
+        async def run_all():
+            services = list(by_service)
+            outcomes = await asyncio.gather(*(run_service(service) for service in services))
+            return dict(zip(services, outcomes))
+
+        outcomes = vty_engine.run(run_all())
+
+        # Put results back in request order
+        results = []
+        position = {service: 0 for service in by_service}
+        for service, command in items:
+            service_results = outcomes[service]
+            index = position[service]
+            position[service] += 1
+            if index < len(service_results):
+                result, elapsed = service_results[index]
+                results.append({
+                    'service': service,
+                    'command': command,
+                    'result': result,
+                    'vty_error': vty_error(result),
+                    'elapsed_ms': round(elapsed * 1000, 3)
+                })
+            else:
+                results.append({'service': service, 'command': command, 'skipped': True})
+
+        return jsonify({
+            'results': results,
+            'timestamp': time.time()
+        })
+
+    except VTYUnavailable as e:
+        return vty_unavailable(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+async def collect_service_status(service, commands, service_status):
+    """Run status commands for one service over a single session"""
+    service_status.update({'connected': False, 'data': {}})
+
+    async with vty_pools[service].session() as vty:
+        if vty.connected:
             service_status['connected'] = True
 
             # Execute status commands
-            for cmd in status_commands.get(service, []):
-                result = vty.send_command(cmd)
-                service_status['data'][cmd] = result
+            for cmd in commands:
+                result = await vty.send_command(cmd)
+                service_status['data'][cmd] = annotate(cmd, result)
+
+
+class StatusCollector:
+    """Polls the status commands in the background and keeps the latest snapshot.
+
+    Clients are served from the snapshot, so backend VTY load depends
+    on the poll interval only and not on how many dashboards are open.
+    """
+
+    def __init__(self, commands, interval=STATUS_POLL_INTERVAL, ttl=STATUS_SNAPSHOT_TTL):
+        # /api/stats is served from the snapshot too, so every service polls 'show stats'
+        self.commands = {
+            service: commands.get(service, []) + ([] if 'show stats' in commands.get(service, []) else ['show stats'])
+            for service in VTY_HOSTS
+        }
+        self.interval = interval
+        self.ttl = ttl
+        self.services = {}  # service -> {'connected', 'timed_out', 'collected_at'[, 'error', 'status']}
+        self.results = {}   # (service, command) -> (result, collected_at)
+        self._inflight = None
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+
+    async def run(self):
+        next_run = time.monotonic()
+        while True:
+            try:
+                await self.collect()
+            except Exception as e:
+                print(f"Status poll failed: {e}")
+            next_run += self.interval
+            await asyncio.sleep(max(0.0, next_run - time.monotonic()))
+
+    async def collect(self):
+        """Refresh the snapshot; concurrent callers share one collection"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._collect())
+            self._inflight.add_done_callback(lambda _: setattr(self, '_inflight', None))
+        return await asyncio.shield(self._inflight)
+
+    async def _collect(self):
+        results = await fan_out(
+            lambda service, result: collect_service_status(service, self.commands[service], result))
+
+        collected_at = time.time()
+        changes = {}
+        for service, service_status in results.items():
+            previous = self.services.get(service, {})
+            changed = {'data': {}}
+            for cmd, result in service_status['data'].items():
+                old = self.results.get((service, cmd))
+                if old is None or old[0] != result:
+                    changed['data'][cmd] = result
+                self.results[(service, cmd)] = (result, collected_at)
+
+            self.services[service] = {
+                'connected': service_status['connected'],
+                'timed_out': service_status['timed_out'],
+                'collected_at': collected_at
+            }
+            # Failure reason and kind (e.g. circuit_open) as set by fan_out
+            for key in ('error', 'status'):
+                if key in service_status:
+                    self.services[service][key] = service_status[key]
+            for key in ('connected', 'timed_out', 'error', 'status'):
+                if previous.get(key) != self.services[service].get(key):
+                    changed[key] = self.services[service].get(key)
+
+            if changed['data'] or len(changed) > 1:
+                changes[service] = changed
+
+        if changes:
+            self._publish({'changes': changes, 'timestamp': collected_at})
+
+    def fresh(self):
+        """True if every service has a snapshot younger than the TTL"""
+        now = time.time()
+        return len(self.services) == len(VTY_HOSTS) and all(
+            now - info['collected_at'] <= self.ttl for info in self.services.values())
+
+    def lookup(self, service, command):
+        """Cached (result, age) for a polled command.
+
+        None if the command is not polled, its last result was a failure,
+        or the result is older than the snapshot TTL or the command's own
+        cache TTL, whichever is shorter.
+        """
+        command = normalize_command(command)
+        entry = self.results.get((service, command))
+        if entry is None:
+            return None
+        result, collected_at = entry
+        if vty_error(result):
+            return None
+        age = time.time() - collected_at
+        return (result, age) if age <= min(self.ttl, command_cache.ttl_for(command)) else None
+
+    def subscribe(self):
+        """Register a listener; returns a queue that receives change events"""
+        events = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self._subscribers_lock:
+            self._subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._subscribers_lock:
+            self._subscribers.discard(events)
+
+    def _publish(self, event):
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # A slow client missed updates; have it resync from a full snapshot
+                with events.mutex:
+                    events.queue.clear()
+                events.put_nowait(None)
+
+    def snapshot(self):
+        """Full status of every service in the /api/status shape"""
+        return {
+            service: self.service_status(service, self.commands[service])
+            for service in VTY_HOSTS if service in self.services
+        }
+
+    def service_status(self, service, commands):
+        """Snapshot of one service in the /api/status shape"""
+        info = self.services[service]
+        service_status = {
+            'connected': info['connected'],
+            'timed_out': info['timed_out'],
+            'age': round(time.time() - info['collected_at'], 3),
+            'data': {}
+        }
+        for key in ('error', 'status'):
+            if key in info:
+                service_status[key] = info[key]
+        for cmd in commands:
+            entry = self.results.get((service, cmd))
+            if entry is not None and entry[1] == info['collected_at']:
+                service_status['data'][cmd] = entry[0]
+        return service_status
+
+
+status_collector = StatusCollector(STATUS_COMMANDS)
+
+
+def status_snapshot():
+    """Make sure the snapshot is fresh, collecting it live if the poller is behind"""
+    if not status_collector.fresh():
+        vty_engine.run(status_collector.collect())
 
-        status[service] = service_status
+
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """Get comprehensive status from all services"""
+    status_snapshot()
+    status = {
+        service: status_collector.service_status(service, STATUS_COMMANDS.get(service, []))
+        for service in VTY_HOSTS
+    }
 
     return jsonify({
         'status': status,
+        'cached': True,
         'timestamp': time.time()
     })
 
 
+class SubscriberCache:
+    """Bounded LRU of MSISDN -> (exists, IMSI) with TTL and negative entries"""
+
+    def __init__(self, size=SUBSCRIBER_CACHE_SIZE, ttl=SUBSCRIBER_CACHE_TTL,
+                 negative_ttl=SUBSCRIBER_CACHE_NEGATIVE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # msisdn -> (exists, imsi, expires)
+        self._lock = threading.Lock()
+
+    def get(self, msisdn):
+        """(exists, imsi) for a cached MSISDN, or None"""
+        with self._lock:
+            entry = self._entries.get(msisdn)
+            if entry is None or entry[2] < time.monotonic():
+                self._entries.pop(msisdn, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(msisdn)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, msisdn, exists, imsi=None):
+        expires = time.monotonic() + (self.ttl if exists else self.negative_ttl)
+        with self._lock:
+            self._entries[msisdn] = (exists, imsi, expires)
+            self._entries.move_to_end(msisdn)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, msisdn):
+        with self._lock:
+            self._entries.pop(msisdn, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+subscriber_cache = SubscriberCache()
+HLR_IMSI_RE = re.compile(r'IMSI:\s*(\d+)')
+
+
+async def ensure_subscriber(msisdn):
+    """Create the subscriber in HLR if it does not exist yet"""
+    cached = subscriber_cache.get(msisdn)
+    if cached and cached[0]:
+        return {'exists': True, 'imsi': cached[1], 'cached': True}
+
+    async with vty_pools['hlr'].session() as hlr_vty:
+        if cached is None:
+            subscriber_check = await hlr_vty.send_command(f"subscriber show msisdn {msisdn}")
+            print(f"HLR subscriber check: {subscriber_check}")
+            if not subscriber_check.get('success'):
+                return {'exists': None, 'imsi': None, 'cached': False}
+
+            output = subscriber_check.get('output', '')
+            exists = 'No subscriber' not in output
+            match = HLR_IMSI_RE.search(output)
+            subscriber_cache.put(msisdn, exists, match.group(1) if match else None)
+            if exists:
+                return {'exists': True, 'imsi': match.group(1) if match else None, 'cached': False}
+
+        # Try to create subscriber if not exists
+        print(f"Creating subscriber {msisdn}")
+        imsi = default_imsi(msisdn)
+        create_result = await hlr_vty.send_command(f"subscriber create imsi {imsi}")
+        if create_result.get('success'):
+            # Set MSISDN
+            update_result = await hlr_vty.send_command(f"subscriber imsi {imsi} update msisdn {msisdn}")
+            if not vty_error(update_result):
+                print(f"Created subscriber {msisdn} with IMSI {imsi}")
+                subscriber_cache.put(msisdn, True, imsi)
+        return {'exists': True, 'imsi': imsi, 'cached': cached is not None, 'created': True}
+
+
+# SMS submission syntaxes seen across OsmoMSC versions, in order of preference.
+# 'syntax' matches the command's line in the VTY 'list' output.
+SMS_COMMAND_FORMATS = [
+    {
+        'name': 'sms-send',
+        'syntax': re.compile(r'^\s*sms send '),
+        'template': 'sms send {to} {sender} {message}'
+    },
+    {
+        'name': 'subscriber-sms-send',
+        'syntax': re.compile(r'^\s*subscriber .*\bsms sender\b.*\bsend\b'),
+        'template': 'subscriber msisdn {to} sms sender msisdn {sender} send {message}'
+    }
+]
+
+# VTY parser errors: the MSC did not accept the command syntax itself
+VTY_SYNTAX_ERRORS = ('Unknown command', 'Command incomplete', 'There is no matched command')
+
+
+def is_syntax_error(result):
+    """True if the VTY rejected the command line rather than the request"""
+    error = vty_error(result)
+    return bool(result.get('success')) and error is not None and \
+        any(text in error for text in VTY_SYNTAX_ERRORS)
+
+
+class SMSCommandFormats:
+    """Learns which SMS submission syntax each MSC backend accepts.
+
+    The syntax is probed once per backend from the VTY 'list' output (at
+    startup or on first use) and then every SMS costs exactly one MSC
+    command. Only a syntax error on send forgets the format and probes
+    again; any other error is the MSC's answer and is returned as is.
+    """
+
+    def __init__(self):
+        self.formats = {}  # service -> {'name', 'template', 'method', 'learned_at'}
+
+    def remember(self, service, fmt, method):
+        self.formats[service] = {
+            'name': fmt['name'],
+            'template': fmt['template'],
+            'method': method,
+            'learned_at': time.time()
+        }
+        print(f"SMS command format for {service}: {fmt['name']} (via {method})")
+
+    def forget(self, service):
+        self.formats.pop(service, None)
+
+    async def probe(self, service, vty=None):
+        """Find the supported syntax in the VTY command list; None if not listed"""
+        if vty is None:
+            async with vty_pools[service].session() as vty:
+                return await self.probe(service, vty)
+
+        listing = await vty.send_command('list')
+        if vty_error(listing):
+            return None
+        lines = listing.get('output', '').split('\n')
+        for fmt in SMS_COMMAND_FORMATS:
+            if any(fmt['syntax'].match(line) for line in lines):
+                self.remember(service, fmt, 'list')
+                return fmt
+        return None
+
+    async def send(self, service, to_number, from_number, message):
+        """Submit an SMS with the learned syntax, re-learning it if it stops working"""
+        params = {'to': to_number, 'sender': from_number, 'message': message}
+
+        async with vty_pools[service].session() as vty:
+            known = self.formats.get(service)
+            if known is None:
+                await self.probe(service, vty)
+                known = self.formats.get(service)
+
+            failed = set()
+            if known is not None:
+                result = await vty.send_command(known['template'].format(**params))
+                if not is_syntax_error(result):
+                    return result, known['name']
+
+                print(f"SMS format {known['name']} failed on {service}: {vty_error(result)}; re-probing")
+                failed.add(known['name'])
+                self.forget(service)
+                fmt = await self.probe(service, vty)
+                if fmt is not None and fmt['name'] not in failed:
+                    result = await vty.send_command(fmt['template'].format(**params))
+                    if not is_syntax_error(result):
+                        return result, fmt['name']
+                    failed.add(fmt['name'])
+                    self.forget(service)
+
+            # Not discoverable from 'list' (e.g. enable-only commands): try each syntax
+            result = {'error': 'No SMS command format accepted by the MSC', 'success': False}
+            for fmt in SMS_COMMAND_FORMATS:
+                if fmt['name'] in failed:
+                    continue
+                print(f"Trying SMS command format: {fmt['name']}")
+                result = await vty.send_command(fmt['template'].format(**params))
+                if not result.get('success'):
+                    return result, None
+                if not is_syntax_error(result):
+                    # Parsed, even if the MSC refused this particular SMS
+                    self.remember(service, fmt, 'trial')
+                    return result, fmt['name']
+
+            return result, None
+
+
+sms_formats = SMSCommandFormats()
+
+
+async def probe_sms_formats():
+    """Learn the MSC's SMS syntax at startup so the first SMS is not slower"""
+    try:
+        await sms_formats.probe('msc')
+    except Exception as e:
+        print(f"SMS format probe failed: {e}")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/stream', methods=['GET'])
+def stream_status():
+    """Server-Sent Events stream of status changes collected by the poller"""
+    events = status_collector.subscribe()
+    status_snapshot()
+
+    def generate():
+        try:
+            yield sse_event('snapshot', {'status': status_collector.snapshot(), 'timestamp': time.time()})
+            while True:
+                try:
+                    event = events.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if event is None:
+                    yield sse_event('snapshot', {'status': status_collector.snapshot(), 'timestamp': time.time()})
+                else:
+                    yield sse_event('update', event)
+        finally:
+            status_collector.unsubscribe(events)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+class TokenBucket:
+    """Token-bucket rate limiter for the engine loop; rate 0 means unlimited"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SMSQueue:
+    """Bounded SMS submission queue drained by a fixed pool of engine-loop workers.
+
+    Each job passes the target MSC's token bucket before it is sent. Queued
+    and sending jobs are always kept; finished ones are kept up to
+    SMS_JOB_HISTORY, oldest evicted first, so clients can poll their state.
+    """
+
+    def __init__(self, size=SMS_QUEUE_SIZE, concurrency=SMS_CONCURRENCY,
+                 rate=SMS_RATE, burst=SMS_BURST, history=SMS_JOB_HISTORY):
+        self.size = size
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.history = history
+        self.sending = 0
+        self.counts = {'queued': 0, 'sent': 0, 'failed': 0, 'rejected': 0}
+        self.buckets = {}
+        self._queue = None
+        self._jobs = {}            # job id -> job dict
+        self._finished = deque()   # ids of finished jobs, oldest first
+        self._lock = threading.Lock()
+
+    def start(self, loop):
+        """Create the queue and its workers on the engine loop"""
+        self._queue = asyncio.Queue(maxsize=self.size)
+        for _ in range(self.concurrency):
+            loop.create_task(self._worker())
+
+    async def enqueue(self, service, from_number, to_number, message):
+        """Queue an SMS and return its job, or None if the queue is full"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'service': service,
+            'state': 'queued',
+            'from': from_number,
+            'to': to_number,
+            'message': message,
+            'queued_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counts['rejected'] += 1
+            return None
+
+        self.counts['queued'] += 1
+        with self._lock:
+            self._jobs[job['id']] = job
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def bucket(self, service):
+        if service not in self.buckets:
+            self.buckets[service] = TokenBucket(self.rate, self.burst)
+        return self.buckets[service]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.bucket(job['service']).acquire()
+                await self._send(job)
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, job):
+        job['state'] = 'sending'
+        job['started_at'] = time.time()
+        self.sending += 1
+        try:
+            job['subscriber'] = await ensure_subscriber(job['to'])
+            result, sms_format = await sms_formats.send(job['service'], job['to'], job['from'], job['message'])
+            job['sms_format'] = sms_format
+            job['result'] = result
+            error = vty_error(result)
+            job['state'] = 'failed' if error else 'sent'
+            if error:
+                job['error'] = error
+        except Exception as e:
+            print(f"SMS Error: {e}")
+            job['state'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            self.sending -= 1
+            job['finished_at'] = time.time()
+            job['queue_ms'] = round((job['started_at'] - job['queued_at']) * 1000, 1)
+            job['send_ms'] = round((job['finished_at'] - job['started_at']) * 1000, 1)
+            self.counts[job['state']] += 1
+            self._retire(job)
+
+    def _retire(self, job):
+        """Add a finished job to the history, evicting the oldest finished ones"""
+        with self._lock:
+            self._finished.append(job['id'])
+            while len(self._finished) > self.history:
+                self._jobs.pop(self._finished.popleft(), None)
+
+    def stats(self):
+        return {
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'capacity': self.size,
+            'concurrency': self.concurrency,
+            'sending': self.sending,
+            'rate': self.rate,
+            'burst': self.burst,
+            'counts': dict(self.counts)
+        }
+
+
+sms_queue = SMSQueue()
+
+
 @app.route('/api/sms/send', methods=['POST'])
 def send_sms():
-    """Send SMS via MSC - FIXED VERSION"""
+    """Queue an SMS for the MSC; poll /api/sms/jobs/<id> for the outcome"""
     try:
         data = request.get_json()
         if not data:
@@ -292,85 +1936,223 @@ def send_sms():
 
         print(f"SMS Request: {from_number} -> {to_number}: {message}")
 
-        # First, check if subscriber exists in HLR
-        hlr_vty = get_vty_connection('hlr')
-        if hlr_vty:
-            subscriber_check = hlr_vty.send_command(f"subscriber show msisdn {to_number}")
-            print(f"HLR subscriber check: {subscriber_check}")
-            
-            if subscriber_check.get('success') and 'No subscriber' in subscriber_check.get('output', ''):
-                # Try to create subscriber if not exists
-                print(f"Creating subscriber {to_number}")
-                imsi = f"001010{to_number.zfill(9)}"  # Generate IMSI
-                create_result = hlr_vty.send_command(f"subscriber create imsi {imsi}")
-                if create_result.get('success'):
-                    # Set MSISDN
-                    hlr_vty.send_command(f"subscriber imsi {imsi} update msisdn {to_number}")
-                    print(f"Created subscriber {to_number} with IMSI {imsi}")
-
-        # Get MSC VTY connection
-        msc_vty = get_vty_connection('msc')
-        if not msc_vty:
-            return jsonify({'error': 'Cannot connect to MSC'}), 500
-
-        # FIXED: Use correct OsmoMSC SMS command format
-        # Try different SMS command formats for OsmoMSC
-        sms_commands = [
-            f"sms send {to_number} {from_number} {message}",
-            f"subscriber msisdn {to_number} sms sender msisdn {from_number} send {message}",
-            f"subscriber show msisdn {to_number}"  # Test command to see if subscriber exists
-        ]
-
-        result = None
-        for cmd in sms_commands:
-            print(f"Trying SMS command: {cmd}")
-            result = msc_vty.send_command(cmd)
-            print(f"SMS command result: {result}")
-            
-            if result.get('success'):
-                # Check if this was the actual SMS send command
-                if 'sms send' in cmd.lower() or 'send' in cmd:
-                    break
-                # If it's a subscriber check and subscriber exists, try to send
-                if 'subscriber show' in cmd and 'No subscriber' not in result.get('output', ''):
-                    # Subscriber exists, now try to send SMS
-                    actual_send = msc_vty.send_command(f"sms send {to_number} {from_number} {message}")
-                    if actual_send.get('success'):
-                        result = actual_send
-                        break
+        job = vty_engine.run(sms_queue.enqueue('msc', from_number, to_number, message))
+        if job is None:
+            return jsonify({'error': 'SMS queue full', 'queue': sms_queue.stats()}), 503
 
         return jsonify({
+            'job_id': job['id'],
+            'state': job['state'],
             'from': from_number,
             'to': to_number,
             'message': message,
-            'result': result,
             'timestamp': time.time()
-        })
+        }), 202, {'Location': f"/api/sms/jobs/{job['id']}"}
 
     except Exception as e:
         print(f"SMS Error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/sms/jobs/<job_id>', methods=['GET'])
+def get_sms_job(job_id):
+    """State and timings of a queued SMS"""
+    job = sms_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown SMS job'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/sms/queue', methods=['GET'])
+def get_sms_queue():
+    """SMS queue depth, worker activity and outcome counters"""
+    return jsonify({'queue': sms_queue.stats(), 'timestamp': time.time()})
+
+
+class HLRDatabase:
+    """Read-only queries against OsmoHLR's SQLite database.
+
+    OsmoHLR keeps the file in WAL mode, so readers never block it.
+    Writes still go through the VTY. Listings use keyset pagination
+    on the unique, indexed id/imsi/msisdn columns.
+    """
+
+    COLUMNS = ('id', 'imsi', 'msisdn', 'imei', 'nam_cs', 'nam_ps', 'vlr_number', 'msc_number', 'last_lu_seen')
+    ORDER_COLUMNS = ('id', 'imsi', 'msisdn')
+
+    def __init__(self, path, connections=HLR_DB_CONNECTIONS):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=connections)
+        self._select = f"SELECT {', '.join(self.COLUMNS)} FROM subscriber"
+
+    def _connect(self):
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=5, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def _query(self, sql, params):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            rows = [dict(row) for row in conn.execute(sql, params)]
+        except Exception:
+            conn.close()
+            raise
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        return rows
+
+    def list_subscribers(self, order='id', after=None, limit=100, imsi_prefix=None, msisdn_prefix=None):
+        """One page of subscribers ordered by order, starting after the given key"""
+        where, params = [], []
+        if after is not None:
+            where.append(f"{order} > ?")
+            params.append(int(after) if order == 'id' else str(after))
+        for column, prefix in (('imsi', imsi_prefix), ('msisdn', msisdn_prefix)):
+            if prefix:
+                # Range instead of LIKE so the column index is used
+                where.append(f"{column} >= ? AND {column} < ?")
+                params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        if order == 'msisdn':
+            where.append("msisdn IS NOT NULL")
+
+        sql = self._select
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        return self._query(sql, params + [limit])
+
+    def lookup(self, imsi=None, msisdn=None):
+        column, value = ('imsi', imsi) if imsi else ('msisdn', msisdn)
+        rows = self._query(f"{self._select} WHERE {column} = ?", [value])
+        return rows[0] if rows else None
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+hlr_db = HLRDatabase(HLR_DB_PATH) if HLR_DB_PATH else None
+
+
+@app.route('/api/sms/format', methods=['GET'])
+def get_sms_format():
+    """SMS command format learned for each MSC backend"""
+    return jsonify({
+        'formats': {'msc': sms_formats.formats.get('msc')},
+        'timestamp': time.time()
+    })
+
+
+@app.route('/api/sms/format/probe', methods=['POST'])
+def reprobe_sms_format():
+    """Forget the learned SMS command format and probe the MSC again"""
+    try:
+        sms_formats.forget('msc')
+        fmt = vty_engine.run(sms_formats.probe('msc'))
+        return jsonify({
+            'formats': {'msc': sms_formats.formats.get('msc')},
+            'probed': fmt is not None,
+            'timestamp': time.time()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/subscribers', methods=['GET'])
 def get_subscribers():
     """Get subscriber list from HLR"""
     try:
-        vty = get_vty_connection('hlr')
-        if not vty:
-            return jsonify({'error': 'Cannot connect to HLR'}), 500
-
-        result = vty.send_command('show subscribers')
+        if hlr_db is None:
+            result = run_vty_command('hlr', 'show subscribers')
+
+            return jsonify({
+                'subscribers': result,
+                'source': 'vty',
+                'timestamp': time.time()
+            })
+
+        order = request.args.get('order', 'id')
+        if order not in HLRDatabase.ORDER_COLUMNS:
+            return jsonify({'error': f'order must be one of {", ".join(HLRDatabase.ORDER_COLUMNS)}'}), 400
+        try:
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        limit = max(1, min(limit, SUBSCRIBER_PAGE_MAX))
+
+        rows = hlr_db.list_subscribers(
+            order=order,
+            after=request.args.get('after'),
+            limit=limit,
+            imsi_prefix=request.args.get('imsi_prefix'),
+            msisdn_prefix=request.args.get('msisdn_prefix')
+        )
 
         return jsonify({
-            'subscribers': result,
+            'subscribers': rows,
+            'source': 'hlr-db',
+            'next_after': rows[-1][order] if len(rows) == limit else None,
             'timestamp': time.time()
         })
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/subscribers/lookup', methods=['GET'])
+def lookup_subscriber():
+    """Look up a single subscriber by MSISDN or IMSI"""
+    try:
+        imsi = request.args.get('imsi')
+        msisdn = request.args.get('msisdn')
+        if not imsi and not msisdn:
+            return jsonify({'error': 'msisdn or imsi is required'}), 400
+
+        if hlr_db is None:
+            kind, value = ('imsi', imsi) if imsi else ('msisdn', msisdn)
+            result = run_vty_command('hlr', f"subscriber show {kind} {value}")
+            return jsonify({'subscriber': result, 'source': 'vty', 'timestamp': time.time()})
+
+        subscriber = hlr_db.lookup(imsi=imsi, msisdn=msisdn)
+        if subscriber is None:
+            return jsonify({'error': 'No such subscriber'}), 404
+
+        return jsonify({'subscriber': subscriber, 'source': 'hlr-db', 'timestamp': time.time()})
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def default_imsi(msisdn):
+    """Test-network IMSI (MCC 001, MNC 01) derived from the MSISDN"""
+    return f"001010{msisdn.zfill(9)}"
+
+
+async def provision_subscriber(imsi, msisdn):
+    """Create a subscriber in HLR and assign its MSISDN"""
+    async with vty_pools['hlr'].session() as hlr_vty:
+        # Create subscriber
+        create_result = await hlr_vty.send_command(f"subscriber create imsi {imsi}")
+        if create_result.get('success'):
+            # Set MSISDN
+            await hlr_vty.send_command(f"subscriber imsi {imsi} update msisdn {msisdn}")
+
+    return create_result
+
+
 @app.route('/api/subscribers/create', methods=['POST'])
 def create_subscriber():
     """Create subscriber in HLR"""
@@ -387,18 +2169,11 @@ def create_subscriber():
 
         # Generate IMSI if not provided
         if not imsi:
-            imsi = f"001010{msisdn.zfill(9)}"
+            imsi = default_imsi(msisdn)
 
-        hlr_vty = get_vty_connection('hlr')
-        if not hlr_vty:
-            return jsonify({'error': 'Cannot connect to HLR'}), 500
+        create_result = vty_engine.run(provision_subscriber(imsi, msisdn))
+        subscriber_cache.invalidate(msisdn)
 
-        # Create subscriber
-        create_result = hlr_vty.send_command(f"subscriber create imsi {imsi}")
-        if create_result.get('success'):
-            # Set MSISDN
-            msisdn_result = hlr_vty.send_command(f"subscriber imsi {imsi} update msisdn {msisdn}")
-            
         return jsonify({
             'imsi': imsi,
             'msisdn': msisdn,
@@ -410,20 +2185,176 @@ def create_subscriber():
         return jsonify({'error': str(e)}), 500
 
 
+def read_bulk_rows(stream, fmt, offset=0):
+    """Yield (row, msisdn, imsi, error) from a CSV or NDJSON request body as it arrives.
+
+    Rows before 'offset' are counted but not parsed. A row that cannot be
+    parsed is yielded with an error instead of ending the stream.
+    """
+    lines = (line.decode('utf-8', errors='replace') for line in stream)
+    n = 0
+
+    if fmt == 'ndjson':
+        for line in lines:
+            if not line.strip():
+                continue
+            if n >= offset:
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, dict):
+                        raise ValueError('expected a JSON object')
+                    yield n, str(row.get('msisdn', '')).strip(), str(row.get('imsi') or '').strip(), None
+                except ValueError as e:
+                    yield n, '', '', f'Invalid row: {e}'
+            n += 1
+        return
+
+    header = None
+    reader = csv.reader(lines)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            if n >= offset:
+                yield n, '', '', f'Invalid row: {e}'
+            n += 1
+            continue
+        if not row or not ''.join(row).strip():
+            continue
+        cells = [cell.strip() for cell in row]
+        if header is None and 'msisdn' in [cell.lower() for cell in cells]:
+            header = [cell.lower() for cell in cells]
+            continue
+        if n >= offset:
+            if header:
+                record = dict(zip(header, cells))
+                yield n, record.get('msisdn', ''), record.get('imsi', ''), None
+            else:
+                yield n, cells[0], cells[1] if len(cells) > 1 else '', None
+        n += 1
+
+
+async def provision_chunk(rows):
+    """Provision a chunk of (msisdn, imsi) rows over one pipelined HLR session"""
+    commands = []
+    for msisdn, imsi in rows:
+        commands.append(f"subscriber create imsi {imsi}")
+        commands.append(f"subscriber imsi {imsi} update msisdn {msisdn}")
+
+    async with vty_pools['hlr'].session() as hlr_vty:
+        if hlr_vty.connected and hlr_vty.hostname:
+            results = [result for result, _ in await hlr_vty.send_pipelined(commands)]
+        else:
+            results = [await hlr_vty.send_command(cmd) for cmd in commands]
+
+    return [(results[i], results[i + 1]) for i in range(0, len(results), 2)]
+
+
+@app.route('/api/subscribers/bulk', methods=['POST'])
+def bulk_create_subscribers():
+    """Provision subscribers from a streamed CSV or NDJSON body.
+
+    Replies with NDJSON: one line per row, a progress line after each
+    chunk with the offset to resume from, and a final summary.
+    """
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'ndjson' if 'ndjson' in (request.content_type or '') else 'csv'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+
+    try:
+        offset = int(request.args.get('offset', 0))
+        chunk_size = max(1, int(request.args.get('chunk', BULK_CHUNK_SIZE)))
+    except ValueError:
+        return jsonify({'error': 'offset and chunk must be integers'}), 400
+
+    def generate():
+        started = time.perf_counter()
+        done = ok = failed = 0
+        position = offset
+        chunk = []
+
+        def flush():
+            nonlocal done, ok, failed, position
+            lines = []
+            valid = [(n, msisdn, imsi) for n, msisdn, imsi, error in chunk if not error]
+            results = vty_engine.run(provision_chunk([(msisdn, imsi) for _, msisdn, imsi in valid])) if valid else []
+            outcome = {n: pair for (n, _, _), pair in zip(valid, results)}
+
+            for n, msisdn, imsi, error in chunk:
+                if not error:
+                    subscriber_cache.invalidate(msisdn)
+                    create_result, update_result = outcome[n]
+                    error = vty_error(update_result) or vty_error(create_result)
+                lines.append(json.dumps({'row': n, 'msisdn': msisdn, 'imsi': imsi, 'ok': not error, 'error': error}))
+                ok += not error
+                failed += bool(error)
+
+            done += len(chunk)
+            position = chunk[-1][0] + 1
+            chunk.clear()
+            elapsed = time.perf_counter() - started
+            lines.append(json.dumps({'progress': {
+                'offset': position,
+                'rows': done,
+                'ok': ok,
+                'failed': failed,
+                'rows_per_sec': round(done / elapsed, 1) if elapsed > 0 else None
+            }}))
+            return '\n'.join(lines) + '\n'
+
+        try:
+            for n, msisdn, imsi, error in read_bulk_rows(request.stream, fmt, offset):
+                if not error and not msisdn.isdigit():
+                    error = 'MSISDN must be digits'
+                imsi = imsi or (default_imsi(msisdn) if not error else '')
+                if not error and not (imsi.isdigit() and len(imsi) <= 15):
+                    error = 'IMSI must be up to 15 digits'
+                chunk.append((n, msisdn, imsi, error))
+
+                if len(chunk) >= chunk_size:
+                    yield flush()
+
+            if chunk:
+                yield flush()
+        except Exception as e:
+            # Everything before 'offset' in the last progress line is provisioned
+            yield json.dumps({'error': str(e), 'offset': position}) + '\n'
+            return
+
+        elapsed = time.perf_counter() - started
+        yield json.dumps({'summary': {
+            'offset': position,
+            'rows': done,
+            'ok': ok,
+            'failed': failed,
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(done / elapsed, 1) if elapsed > 0 else None
+        }}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get statistics from all services"""
     try:
         stats = {}
 
-        for service in VTY_HOSTS.keys():
-            vty = get_vty_connection(service)
-            if vty and vty.connect():
-                result = vty.send_command('show stats')
-                stats[service] = result
+        status_snapshot()
+        for service in VTY_HOSTS:
+            service_status = status_collector.service_status(service, ['show stats'])
+            if 'show stats' in service_status['data']:
+                stats[service] = dict(service_status['data']['show stats'], age=service_status['age'])
+            elif service_status['timed_out']:
+                stats[service] = {'error': 'No response from service', 'success': False, 'timed_out': True}
 
         return jsonify({
             'stats': stats,
+            'cached': True,
             'timestamp': time.time()
         })
 
@@ -431,11 +2362,136 @@ def get_stats():
         return jsonify({'error': str(e)}), 500
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method,
+                                     str(response.status_code))
+    return response
+
+
+# Per-request fields that must not change the ETag of otherwise identical JSON
+VOLATILE_JSON_RE = re.compile(rb'"(?:timestamp|age|elapsed_ms)":\s*-?[0-9.eE+-]+,?')
+
+
+def content_etag(body):
+    """Weak ETag of a response body, ignoring per-request timing fields"""
+    digest = hashlib.blake2b(VOLATILE_JSON_RE.sub(b'', body), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against etag"""
+    tags = {tag.strip() for tag in header.split(',') if tag.strip()}
+    return '*' in tags or etag in tags or etag[2:] in tags
+
+
+@app.after_request
+def conditional_response(response):
+    """ETag/If-None-Match for GETs and gzip/brotli for large bodies"""
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+        return response
+
+    body = response.get_data()
+    if request.method in ('GET', 'HEAD'):
+        etag = content_etag(body)
+        response.headers['ETag'] = etag
+        response.headers.setdefault('Cache-Control', 'no-cache')
+        response.vary.add('Accept-Encoding')
+        if etag_matches(request.headers.get('If-None-Match', ''), etag):
+            not_modified = Response(status=304)
+            not_modified.headers['ETag'] = etag
+            not_modified.headers['Cache-Control'] = response.headers['Cache-Control']
+            not_modified.vary.add('Accept-Encoding')
+            return not_modified
+
+    if len(body) >= COMPRESS_MIN_SIZE and 'Content-Encoding' not in response.headers:
+        encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+        if encoding == 'br':
+            response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        elif encoding == 'gzip':
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+    return response
+
+
+def cache_samples():
+    """(name, hits, misses) of every proxy cache"""
+    return [
+        ('subscribers', subscriber_cache.hits, subscriber_cache.misses),
+        ('parsed_output', parse_cache.hits, parse_cache.misses),
+        ('commands', command_cache.hits, command_cache.misses)
+    ]
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the proxy's metrics"""
+    pools = sorted(vty_pools.items())
+    caches = cache_samples()
+    queue_stats = sms_queue.stats()
+
+    lines = HTTP_REQUEST_SECONDS.render() + VTY_COMMAND_SECONDS.render() + VTY_CONNECTS.render()
+    lines += VTY_COALESCED.render()
+    lines += metric_family('vty_proxy_vty_reads_total', 'counter',
+                           'VTY reads by how they ended (prompt, timeout, eof)',
+                           [(('service', 'outcome'), (service, outcome), count)
+                            for service, pool in pools for outcome, count in sorted(pool.reads.items())])
+    lines += metric_family('vty_proxy_vty_pool_size', 'gauge', 'Maximum VTY sessions per service',
+                           [(('service',), (service,), pool.size) for service, pool in pools])
+    lines += metric_family('vty_proxy_vty_pool_sessions', 'gauge', 'Open VTY sessions by state',
+                           [(('service', 'state'), (service, state), count)
+                            for service, pool in pools
+                            for state, count in (('in_use', pool.in_use), ('idle', len(pool._idle)))])
+    lines += metric_family('vty_proxy_vty_circuit_state', 'gauge', 'VTY circuit breaker state (1 = current)',
+                           [(('service', 'state'), (service, state), int(pool.breaker.state == state))
+                            for service, pool in pools for state in ('closed', 'half_open', 'open')])
+    lines += metric_family('vty_proxy_vty_circuit_opens_total', 'counter', 'Times a VTY circuit opened',
+                           [(('service',), (service,), pool.breaker.opened) for service, pool in pools])
+    lines += metric_family('vty_proxy_cache_hits_total', 'counter', 'Cache hits',
+                           [(('cache',), (name,), hits) for name, hits, _ in caches])
+    lines += metric_family('vty_proxy_cache_misses_total', 'counter', 'Cache misses',
+                           [(('cache',), (name,), misses) for name, _, misses in caches])
+    lines += metric_family('vty_proxy_cache_hit_ratio', 'gauge', 'Cache hits / lookups since start',
+                           [(('cache',), (name,), round(hits / (hits + misses), 4) if hits + misses else 0)
+                            for name, hits, misses in caches])
+    lines += metric_family('vty_proxy_sms_queue_depth', 'gauge', 'SMS jobs waiting for a worker',
+                           [((), (), queue_stats['depth'])])
+    lines += metric_family('vty_proxy_sms_jobs_total', 'counter', 'SMS jobs by outcome',
+                           [(('state',), (state,), count) for state, count in sorted(queue_stats['counts'].items())])
+
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
 
+def vty_unavailable(error):
+    """503 response for a backend that is busy or behind an open circuit"""
+    body = {'error': str(error), 'status': error.status}
+    headers = {}
+    if error.retry_after is not None:
+        body['retry_after'] = error.retry_after
+        headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    return jsonify(body), 503, headers
+
+
+@app.errorhandler(VTYUnavailable)
+def backend_unavailable(error):
+    return vty_unavailable(error)
+
+
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
@@ -445,15 +2501,18 @@ if __name__ == '__main__':
     print("Starting VTY Proxy Server...")
     print("Available services:")
     for service, host_info in VTY_HOSTS.items():
-        print(f"  {service}: {host_info['name']} ({host_info['host']}:{host_info['port']})")
+        print(f"  {service}: {host_info['name']} ({host_info['host']}:{host_info['port']}) "
+              f"pool={host_info['pool_size']}")
 
     # Clean up connections on exit
     import atexit
 
     def cleanup():
-        for vty in vty_connections.values():
-            vty.disconnect()
+        vty_engine.run(close_pools(), timeout=5)
+        if hlr_db is not None:
+            hlr_db.close()
 
     atexit.register(cleanup)
+    vty_engine.start()
 
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -5,16 +5,29 @@ Interfaces with osmo-stp via VTY and simulates SMS traffic
 """
 
 import socket
+import os
+import io
+import glob
+import gzip
 import time
+import asyncio
 import threading
 import json
 import random
 import argparse
+import math
+import heapq
+from array import array
 from datetime import datetime
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 import logging
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -39,10 +52,24 @@ class SMSMessage:
     priority: str = "normal"
     timestamp: datetime = None
     status: str = "pending"
+    template: Optional[str] = None
+    seed: Optional[int] = None  # text is render_template(template, seed)
     
     def __post_init__(self):
         if self.timestamp is None:
             self.timestamp = datetime.now()
+    
+    def to_record(self) -> dict:
+        """Message as it appears in exported logs"""
+        return {
+            'id': self.id,
+            'from': self.from_number,
+            'to': self.to_number,
+            'text': self.text,
+            'type': self.message_type,
+            'status': self.status,
+            'timestamp': self.timestamp.isoformat()
+        }
 
 class VTYConnection:
     """VTY connection handler for osmo-stp"""
@@ -61,7 +88,7 @@ class VTYConnection:
             self.socket.connect((self.host, self.port))
             
             # Read welcome message
-            response = self.socket.recv(1024).decode('utf-8')
+            response = self.socket.recv(1024).decode('utf-8', errors='ignore')
             logger.info(f"VTY connected: {response.strip()}")
             
             self.connected = True
@@ -80,7 +107,7 @@ class VTYConnection:
         try:
             self.socket.send(f"{command}\n".encode('utf-8'))
             time.sleep(0.1)  # Small delay for response
-            response = self.socket.recv(4096).decode('utf-8')
+            response = self.socket.recv(4096).decode('utf-8', errors='ignore')
             return response.strip()
             
         except Exception as e:
@@ -115,12 +142,601 @@ class VTYConnection:
                 pass
         self.connected = False
 
+class TrafficProfile:
+    """Open-loop arrival profile built from a spec like ``kind:key=value,...``
+
+      constant:rate=100                        fixed spacing
+      poisson:rate=100                         exponential inter-arrivals
+      ramp:start=100,end=1000,step=100,every=10
+      sine:base=500,amplitude=300,period=60
+      diurnal:base=500,amplitude=300,period=86400   starts at the trough
+
+    Every kind also takes ``arrivals=poisson`` to randomise the spacing
+    around its current rate.
+    """
+
+    DEFAULTS = {
+        'constant': {'rate': 5},
+        'poisson': {'rate': 5},
+        'ramp': {'start': 1, 'end': 100, 'step': 10, 'every': 10},
+        'sine': {'base': 50, 'amplitude': 25, 'period': 60},
+        'diurnal': {'base': 50, 'amplitude': 25, 'period': 86400},
+    }
+
+    def __init__(self, kind: str, poisson: bool = False, **params):
+        self.kind = kind
+        self.poisson = poisson or kind == 'poisson'
+        self.params = {**self.DEFAULTS[kind], **params}
+        self._validate()
+
+    def _validate(self):
+        """Reject profiles whose rate can reach zero or below"""
+        p = self.params
+        for key in ('rate', 'start', 'end', 'base'):
+            if key in p and p[key] <= 0:
+                raise ValueError(f"{self.kind} {key} must be positive")
+        if self.kind == 'ramp' and (p['step'] <= 0 or p['every'] <= 0):
+            raise ValueError("ramp step and every must be positive")
+        if self.kind in ('sine', 'diurnal'):
+            if p['period'] <= 0:
+                raise ValueError(f"{self.kind} period must be positive")
+            if abs(p['amplitude']) >= p['base']:
+                raise ValueError(f"{self.kind} amplitude must be smaller than base")
+
+    @classmethod
+    def parse(cls, spec: str) -> 'TrafficProfile':
+        kind, _, options = spec.strip().partition(':')
+        if kind not in cls.DEFAULTS:
+            raise ValueError(f"unknown profile '{kind}' (expected one of {', '.join(cls.DEFAULTS)})")
+        params, poisson = {}, False
+        for option in filter(None, options.split(',')):
+            key, sep, value = option.partition('=')
+            key = key.strip()
+            if key == 'arrivals':
+                if value not in ('uniform', 'poisson'):
+                    raise ValueError(f"arrivals must be uniform or poisson, not '{value}'")
+                poisson = value == 'poisson'
+            elif not sep or key not in cls.DEFAULTS[kind]:
+                raise ValueError(f"bad option '{option}' for {kind} profile")
+            else:
+                params[key] = float(value)
+        return cls(kind, poisson, **params)
+
+    def rate(self, t: float) -> float:
+        """Offered rate (messages/s) at t seconds into the run"""
+        p = self.params
+        if self.kind in ('constant', 'poisson'):
+            return p['rate']
+        if self.kind == 'ramp':
+            steps = math.floor(t / p['every'])
+            if p['end'] >= p['start']:
+                return min(p['start'] + steps * p['step'], p['end'])
+            return max(p['start'] - steps * p['step'], p['end'])
+        phase = 2 * math.pi * t / p['period']
+        if self.kind == 'sine':
+            return max(0.0, p['base'] + p['amplitude'] * math.sin(phase))
+        return max(0.0, p['base'] - p['amplitude'] * math.cos(phase))
+
+    def arrivals(self, horizon: float = math.inf, step: float = 0.01):
+        """Yield arrival times in seconds from the start of the run.
+
+        Each arrival is due once the integrated rate reaches the next unit
+        (or an exponential draw for Poisson arrivals), walking time in
+        steps of at most `step` so changes in the rate are followed. The
+        first time at or past `horizon` is yielded last, so a stretch with
+        no traffic ends the generator instead of looping forever.
+        """
+        t = 0.0
+        while t < horizon:
+            need = random.expovariate(1.0) if self.poisson else 1.0
+            while t < horizon:
+                rate = self.rate(t)
+                if rate * step >= need:
+                    t += need / rate
+                    break
+                need -= max(0.0, rate) * step
+                t += step
+            yield min(t, horizon)
+
+    def expected(self, duration: float) -> float:
+        """Number of arrivals the profile offers in the first duration seconds"""
+        slices = 1000
+        width = duration / slices
+        return sum(self.rate((i + 0.5) * width) for i in range(slices)) * width
+
+    def __str__(self):
+        options = ','.join(f"{k}={v:g}" for k, v in self.params.items())
+        if self.poisson and self.kind != 'poisson':
+            options += ',arrivals=poisson'
+        return f"{self.kind}:{options}"
+
+class DelayDistribution:
+    """Random delay in seconds from a spec like ``uniform:1,3``
+
+      fixed:2          always 2 s
+      uniform:1,3      between 1 and 3 s
+      exp:2            exponential with a 2 s mean
+      normal:2,0.5     mean 2 s, standard deviation 0.5 s (never negative)
+    """
+
+    ARGS = {'fixed': 1, 'uniform': 2, 'exp': 1, 'normal': 2}
+
+    def __init__(self, kind: str, *args: float):
+        self.kind = kind
+        self.args = args
+
+    @classmethod
+    def parse(cls, spec: str) -> 'DelayDistribution':
+        kind, _, values = spec.strip().partition(':')
+        if kind not in cls.ARGS:
+            raise ValueError(f"unknown delay distribution '{kind}' (expected one of {', '.join(cls.ARGS)})")
+        args = [float(v) for v in values.split(',') if v.strip()]
+        if len(args) != cls.ARGS[kind] or any(a < 0 for a in args):
+            raise ValueError(f"{kind} delay takes {cls.ARGS[kind]} non-negative value(s)")
+        return cls(kind, *args)
+
+    def sample(self) -> float:
+        if self.kind == 'fixed':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return random.uniform(*self.args)
+        if self.kind == 'exp':
+            return random.expovariate(1.0 / self.args[0]) if self.args[0] > 0 else 0.0
+        return max(0.0, random.gauss(*self.args))
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(f'{a:g}' for a in self.args)}"
+
+class DeliveryScheduler:
+    """Tick-bucketed timer queue for delayed delivery reports.
+
+    Reports are grouped by due tick (`resolution` seconds) into array
+    buckets of packed integers (message id and outcome). Each pending
+    report costs about 8 bytes, so millions can wait at once. A min-heap of
+    occupied ticks tells the single service thread when to wake up.
+    schedule() returns a handle that cancel() uses to remove the report
+    from its bucket.
+    """
+
+    OUTCOMES = ('sent', 'failed')
+
+    def __init__(self, handler: Callable[[int, str], None], resolution: float = 0.01):
+        self.handler = handler
+        self.resolution = resolution
+        self.origin = time.monotonic()
+        self.buckets: Dict[int, array] = {}
+        self.ticks: List[int] = []
+        self.cancelled = 0
+        self.pending = 0
+        self.fired = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+
+    def schedule(self, message_id: int, outcome: str, delay: float) -> tuple:
+        """Fire handler(message_id, outcome) after delay seconds; returns a cancel handle"""
+        tick = math.ceil((time.monotonic() - self.origin + delay) / self.resolution)
+        code = message_id * len(self.OUTCOMES) + self.OUTCOMES.index(outcome)
+        with self.lock:
+            bucket = self.buckets.get(tick)
+            if bucket is None:
+                bucket = self.buckets[tick] = array('q')
+                heapq.heappush(self.ticks, tick)
+                if self.ticks[0] == tick:
+                    self.wakeup.notify()
+            bucket.append(code)
+            self.pending += 1
+        if self.thread is None:
+            self.start()
+        return tick, code
+
+    def cancel(self, handle: tuple) -> bool:
+        """Remove a pending report; False if it already fired or was cancelled"""
+        tick, code = handle
+        with self.lock:
+            bucket = self.buckets.get(tick)
+            if bucket is None or code not in bucket:
+                return False
+            bucket.remove(code)
+            self.pending -= 1
+            self.cancelled += 1
+            return True
+
+    def poll(self) -> int:
+        """Fire every report that is due; returns how many fired"""
+        now_tick = math.floor((time.monotonic() - self.origin) / self.resolution)
+        fired = 0
+        while True:
+            with self.lock:
+                if not self.ticks or self.ticks[0] > now_tick:
+                    break
+                bucket = self.buckets.pop(heapq.heappop(self.ticks))
+                self.pending -= len(bucket)
+            for code in bucket:
+                message_id, outcome = divmod(code, len(self.OUTCOMES))
+                self.handler(message_id, self.OUTCOMES[outcome])
+                fired += 1
+        self.fired += fired
+        return fired
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='delivery-reports', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                timeout = None
+                if self.ticks:
+                    timeout = self.origin + self.ticks[0] * self.resolution - time.monotonic()
+                if timeout is None or timeout > 0:
+                    self.wakeup.wait(timeout)
+            self.poll()
+
+    def stats(self) -> dict:
+        return {'pending': self.pending, 'fired': self.fired, 'cancelled': self.cancelled}
+
+class MessageStore:
+    """Bounded columnar store for finished messages.
+
+    A record is one row across typed arrays. It holds an epoch timestamp,
+    packed phone numbers, and interned template/status/type ids. Template
+    texts are kept as the seed they were rendered from, so a record costs
+    about 40 bytes instead of a dataclass with a datetime and its own
+    text. Once `retention` records are held, the oldest is overwritten
+    (ring buffer) after being appended to an NDJSON spill file.
+    """
+
+    def __init__(self, render: Callable[[str, int], str], retention: int = 1000000,
+                 spill_path: Optional[str] = None):
+        self.render = render
+        self.retention = max(1, retention)
+        self.spill_path = spill_path or f"sms_spill_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+        self.spill_file = None
+        self.spilled = 0
+        self.total = 0
+        self.head = 0  # oldest slot once the ring is full
+        self.ids = array('q')
+        self.timestamps = array('d')
+        self.from_numbers = array('q')
+        self.to_numbers = array('q')
+        self.templates = array('H')
+        self.statuses = array('H')
+        self.types = array('H')
+        self.seeds = array('I')
+        self.texts: List[Optional[str]] = []  # None when the seed reproduces the text
+        self.odd_numbers: Dict[int, tuple] = {}  # slot -> numbers that do not pack
+        self.names: List[Optional[str]] = [None]
+        self.name_ids: Dict[Optional[str], int] = {None: 0}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _intern(self, name: Optional[str]) -> int:
+        index = self.name_ids.get(name)
+        if index is None:
+            with self.lock:
+                index = self.name_ids.setdefault(name, len(self.names))
+                if index == len(self.names):
+                    self.names.append(name)
+        return index
+
+    @staticmethod
+    def _pack_number(number: str) -> int:
+        # '+digits' -> 1digits, 'digits' -> 2digits; -1 when it does not fit
+        if number[:1] == '+' and number[1:].isdigit() and len(number) <= 18:
+            return int('1' + number[1:])
+        if number.isdigit() and len(number) <= 17:
+            return int('2' + number)
+        return -1
+
+    @staticmethod
+    def _unpack_number(packed: int) -> str:
+        digits = str(packed)
+        return '+' + digits[1:] if digits[0] == '1' else digits[1:]
+
+    def add(self, sms: SMSMessage):
+        compact = sms.template is not None and sms.seed is not None
+        from_packed = self._pack_number(sms.from_number)
+        to_packed = self._pack_number(sms.to_number)
+        template = self._intern(sms.template)
+        status = self._intern(sms.status)
+        message_type = self._intern(sms.message_type)
+
+        with self.lock:
+            self.total += 1
+            if len(self.ids) < self.retention:
+                slot = len(self.ids)
+                self.ids.append(sms.id)
+                self.timestamps.append(sms.timestamp.timestamp())
+                self.from_numbers.append(from_packed)
+                self.to_numbers.append(to_packed)
+                self.templates.append(template)
+                self.statuses.append(status)
+                self.types.append(message_type)
+                self.seeds.append(sms.seed if compact else 0)
+                self.texts.append(None if compact else sms.text)
+            else:
+                slot = self.head
+                self._spill(slot)
+                self.odd_numbers.pop(slot, None)
+                self.ids[slot] = sms.id
+                self.timestamps[slot] = sms.timestamp.timestamp()
+                self.from_numbers[slot] = from_packed
+                self.to_numbers[slot] = to_packed
+                self.templates[slot] = template
+                self.statuses[slot] = status
+                self.types[slot] = message_type
+                self.seeds[slot] = sms.seed if compact else 0
+                self.texts[slot] = None if compact else sms.text
+                self.head = (slot + 1) % self.retention
+            if from_packed < 0 or to_packed < 0:
+                self.odd_numbers[slot] = (sms.from_number if from_packed < 0 else None,
+                                          sms.to_number if to_packed < 0 else None)
+
+    def _spill(self, slot: int):
+        """Append the record in `slot` to the spill file in its compact row form"""
+        if self.spill_file is None:
+            self.spill_file = open(self.spill_path, 'a', encoding='utf-8')
+            logger.info(f"Message store full ({self.retention} records), spilling to {self.spill_path}")
+        odd_from, odd_to = self.odd_numbers.get(slot, (None, None))
+        text = self.texts[slot]
+        self.spill_file.write(json.dumps([
+            self.ids[slot], self.timestamps[slot],
+            odd_from if odd_from is not None else self._unpack_number(self.from_numbers[slot]),
+            odd_to if odd_to is not None else self._unpack_number(self.to_numbers[slot]),
+            self.names[self.templates[slot]], self.names[self.statuses[slot]],
+            self.names[self.types[slot]], self.seeds[slot] if text is None else text
+        ], ensure_ascii=False) + '\n')
+        self.spilled += 1
+
+    def _record(self, slot: int) -> dict:
+        odd_from, odd_to = self.odd_numbers.get(slot, (None, None))
+        text = self.texts[slot]
+        return self._expand(
+            self.ids[slot], self.timestamps[slot],
+            odd_from if odd_from is not None else self._unpack_number(self.from_numbers[slot]),
+            odd_to if odd_to is not None else self._unpack_number(self.to_numbers[slot]),
+            self.names[self.templates[slot]], self.names[self.statuses[slot]],
+            self.names[self.types[slot]], self.seeds[slot] if text is None else text
+        )
+
+    def _expand(self, message_id, timestamp, from_num, to_num, template, status, message_type, text) -> dict:
+        """Export form of a row; an integer text is the template seed"""
+        if isinstance(text, int):
+            text = self.render(template, text)
+        return {
+            'id': message_id,
+            'from': from_num,
+            'to': to_num,
+            'text': text,
+            'type': message_type,
+            'status': status,
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat()
+        }
+
+    def records(self):
+        """Yield every record, oldest first: spilled ones, then those in memory"""
+        if self.spill_file is not None:
+            with self.lock:
+                self.spill_file.flush()
+            with open(self.spill_path, encoding='utf-8') as f:
+                for n, line in enumerate(f):
+                    if n >= self.spilled:
+                        break
+                    yield self._expand(*json.loads(line))
+        size = len(self.ids)
+        for i in range(size):
+            yield self._record((self.head + i) % size)
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+
+    def stats(self) -> dict:
+        return {'retained': len(self.ids), 'spilled': self.spilled, 'retention': self.retention}
+
+class StreamExporter:
+    """Append each finished message to NDJSON segments during the run.
+
+    Segments are named <prefix>.<n>.ndjson[.gz|.zst]. A new one starts after
+    rotate_bytes of uncompressed output or rotate_seconds, whichever comes
+    first (0 disables either limit). The fsync policy is one of:
+    - 'none'
+    - 'rotate': when a segment is closed
+    - 'always': after every line
+    - a number of seconds between syncs
+    close() appends a metadata line with the final statistics so
+    rebuild_summary() can recreate the export_log() file.
+    """
+
+    SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, prefix: str, rotate_bytes: int = 0, rotate_seconds: float = 0,
+                 compression: Optional[str] = None, fsync: str = 'rotate'):
+        if compression not in self.SUFFIXES:
+            raise ValueError(f"unknown compression '{compression}' (expected gzip or zstd)")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        if fsync not in ('none', 'rotate', 'always'):
+            try:
+                float(fsync)
+            except ValueError:
+                raise ValueError(f"fsync policy must be none, rotate, always or seconds, not '{fsync}'")
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compression = compression
+        self.fsync = fsync
+        self.sync_interval = float(fsync) if fsync not in ('none', 'rotate', 'always') else 0
+        self.segment = 0
+        self.segment_bytes = 0
+        self.segment_started = 0.0
+        self.last_sync = 0.0
+        self.lines = 0
+        self.raw = None
+        self.stream = None
+        self.lock = threading.Lock()
+
+    def _open(self):
+        path = f"{self.prefix}.{self.segment:04d}.ndjson{self.SUFFIXES[self.compression]}"
+        self.raw = open(path, 'wb')
+        if self.compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            self.stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self.stream = self.raw
+        self.segment_bytes = 0
+        self.segment_started = self.last_sync = time.monotonic()
+        logger.info(f"Streaming messages to {path}")
+
+    def _sync(self):
+        # Flushing a compressor emits a sync block, so everything written so far can be decoded
+        self.stream.flush()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.last_sync = time.monotonic()
+
+    def _close_segment(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        if self.fsync != 'none':
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+        self.raw.close()
+        self.raw = self.stream = None
+        self.segment += 1
+
+    def _write(self, data: dict):
+        line = (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+        if self.raw is None:
+            self._open()
+        self.stream.write(line)
+        self.segment_bytes += len(line)
+        self.lines += 1
+
+        now = time.monotonic()
+        if self.fsync == 'always' or (self.sync_interval and now - self.last_sync >= self.sync_interval):
+            self._sync()
+        if ((self.rotate_bytes and self.segment_bytes >= self.rotate_bytes) or
+                (self.rotate_seconds and now - self.segment_started >= self.rotate_seconds)):
+            self._close_segment()
+
+    def write(self, sms: SMSMessage):
+        with self.lock:
+            self._write(sms.to_record())
+
+    def close(self, statistics: Optional[dict] = None):
+        with self.lock:
+            if statistics is not None:
+                self._write({'metadata': {'export_time': datetime.now().isoformat(),
+                                          'statistics': statistics}})
+            if self.raw is not None:
+                self._close_segment()
+
+    def stats(self) -> dict:
+        return {'prefix': self.prefix, 'segment': self.segment, 'lines': self.lines}
+
+def stream_segments(prefix: str) -> List[str]:
+    """Segment files written by StreamExporter for prefix, in write order"""
+    paths = glob.glob(f"{glob.escape(prefix)}.[0-9]*.ndjson*")
+    return sorted(paths, key=lambda path: int(path[len(prefix) + 1:].split('.', 1)[0]))
+
+def read_stream(prefix: str):
+    """Yield every line of a message stream as a dict.
+
+    A segment cut short by a crash is read up to its last complete line.
+    """
+    for path in stream_segments(prefix):
+        if path.endswith('.gz'):
+            f = gzip.open(path, 'rb')
+        elif path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"{path} needs the zstandard package")
+            f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+        else:
+            f = open(path, 'rb')
+        try:
+            for line in io.TextIOWrapper(f, encoding='utf-8'):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping incomplete line in {path}")
+        except (EOFError, OSError) + ((zstandard.ZstdError,) if zstandard else ()):
+            logger.warning(f"{path} ends early, using the lines before the cut")
+        finally:
+            f.close()
+
+def write_export(filename: str, metadata: dict, records) -> int:
+    """Write the export_log() layout, record by record; returns the message count
+
+    The output is the same layout as json.dump(..., indent=2), but records are
+    written as they are produced and never held in memory together.
+    """
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('{\n  "metadata": ')
+        f.write(json.dumps(metadata, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+        f.write(',\n  "messages": [')
+        count = 0
+        for record in records:
+            f.write(',\n    ' if count else '\n    ')
+            f.write(json.dumps(record, indent=2, ensure_ascii=False).replace('\n', '\n    '))
+            count += 1
+        f.write('\n  ]\n}' if count else ']\n}')
+    return count
+
+def rebuild_summary(prefix: str, filename: Optional[str] = None) -> str:
+    """Recreate the export_log() summary file from a message stream.
+
+    Statistics come from the stream's closing metadata line. When that line
+    is missing (the run crashed), they are recounted from the messages and
+    'received' is unknown (0).
+    """
+    if filename is None:
+        filename = f"{os.path.basename(prefix)}_summary.json"
+    counts = {'sent': 0, 'failed': 0, 'total': 0}
+    closing = None
+    for entry in read_stream(prefix):
+        if 'metadata' in entry:
+            closing = entry['metadata']
+            continue
+        counts['sent' if entry.get('status') == 'sent' else 'failed'] += 1
+        counts['total'] += 1
+
+    if closing:
+        statistics = closing['statistics']
+    else:
+        success_rate = counts['sent'] / max(1, counts['total']) * 100
+        statistics = {
+            'sent': counts['sent'],
+            'received': 0,
+            'failed': counts['failed'],
+            'total': counts['total'],
+            'success_rate': f"{success_rate:.1f}%",
+            'total_processed': counts['total']
+        }
+    metadata = {
+        'export_time': closing['export_time'] if closing else datetime.now().isoformat(),
+        'total_messages': counts['total'],
+        'statistics': statistics,
+        'stream': {'prefix': prefix, 'segments': len(stream_segments(prefix)), 'complete': closing is not None}
+    }
+    write_export(filename, metadata, (entry for entry in read_stream(prefix) if 'metadata' not in entry))
+    logger.info(f"Rebuilt {counts['total']} messages from {prefix} into {filename}")
+    return filename
+
 class SMSSimulator:
     """Main SMS simulator class"""
     
     def __init__(self):
         self.vty = VTYConnection()
-        self.messages: List[SMSMessage] = []
+        self.messages = MessageStore(self.render_template)
+        self.stream: Optional[StreamExporter] = None
         self.message_id = 1
         self.stats = {
             'sent': 0,
@@ -130,6 +746,16 @@ class SMSSimulator:
         }
         self.running = False
         self.traffic_thread = None
+        self.traffic_report = None
+        self.in_flight = 0
+        self.in_flight_peak = 0
+        
+        # Delivery reports: one timer queue, delay distribution per send outcome
+        self.reports = DeliveryScheduler(self._delivery_report)
+        self.report_delays: Dict[str, DelayDistribution] = {
+            'sent': DelayDistribution('uniform', 1, 3)
+        }
+        self.log_reports = True
         
         # SMS templates
         self.templates = {
@@ -175,20 +801,17 @@ class SMSSimulator:
                 sms.status = "sent"
                 self.stats['sent'] += 1
                 logger.info(f"SMS {sms.id} sent successfully")
-                
-                # Simulate delivery report
-                threading.Timer(
-                    random.uniform(1, 3),
-                    self._delivery_report,
-                    args=[sms.id]
-                ).start()
-                
             else:
                 sms.status = "failed"
                 self.stats['failed'] += 1
                 logger.warning(f"SMS {sms.id} failed to send")
             
-            self.messages.append(sms)
+            # Simulate delivery report
+            self._schedule_report(sms)
+            
+            self.messages.add(sms)
+            if self.stream:
+                self.stream.write(sms)
             self.stats['total'] += 1
             
             return success
@@ -199,11 +822,131 @@ class SMSSimulator:
             self.stats['failed'] += 1
             return False
     
-    def _delivery_report(self, message_id: int):
+    def _schedule_report(self, sms: SMSMessage):
+        delay = self.report_delays.get(sms.status)
+        if delay:
+            self.reports.schedule(sms.id, sms.status, delay.sample())
+    
+    def _delivery_report(self, message_id: int, outcome: str = 'sent'):
         """Simulate delivery report"""
-        self.stats['received'] += 1
-        logger.info(f"Delivery report for SMS {message_id}: DELIVERED")
+        if outcome == 'sent':
+            self.stats['received'] += 1
+            report = "DELIVERED"
+        else:
+            report = "UNDELIVERABLE"
+        if self.log_reports:
+            logger.info(f"Delivery report for SMS {message_id}: {report}")
+        else:
+            logger.debug(f"Delivery report for SMS {message_id}: {report}")
     
+    def render_template(self, template_name: str, seed: Optional[int] = None) -> str:
+        """Template text with placeholder values derived from a 32-bit seed.
+
+        The same seed always renders the same text, so the message store
+        keeps only the seed. A random seed is drawn when none is given.
+        """
+        if seed is None:
+            seed = random.getrandbits(32)
+        return self.templates[template_name].format(
+            code=str(100000 + seed % 900000),
+            balance=f"{10 + (seed >> 8) % 9001 / 100:.2f}",
+            amount=f"{1 + (seed >> 16) % 1901 / 100:.2f}"
+        )
+
+    def _complete_async(self, sms: SMSMessage):
+        """Finish an in-flight SMS on the event loop (same 95% success model as send_sms)"""
+        self.in_flight -= 1
+        if random.random() > 0.05:
+            sms.status = "sent"
+            self.stats['sent'] += 1
+        else:
+            sms.status = "failed"
+            self.stats['failed'] += 1
+            logger.debug(f"SMS {sms.id} failed to send")
+        self._schedule_report(sms)
+
+        self.messages.add(sms)
+        if self.stream:
+            self.stream.write(sms)
+        self.stats['total'] += 1
+
+    async def run_traffic_async(self, tps: float, duration: float,
+                                profile: TrafficProfile = None, late_after: float = 0.01) -> dict:
+        """Generate open-loop traffic on the event loop with many messages in flight.
+
+        Messages are sent at the profile's arrival times, measured from one
+        absolute start, so slow sends never reduce the offered load and the
+        rate does not drift. A send more than late_after seconds behind its
+        arrival time still goes out and is counted as late. A message's
+        network time is a loop timer rather than a blocking sleep, which
+        keeps thousands of messages in flight on one core.
+        """
+        loop = asyncio.get_running_loop()
+        profile = profile or TrafficProfile('constant', rate=tps)
+        template_names = list(self.templates.keys())
+        self.running = True
+        self.in_flight_peak = self.in_flight
+        # Thousands of reports per second: keep them out of the info log
+        self.log_reports = False
+
+        logger.info(f"Starting async traffic engine: {profile} for {duration} seconds")
+        started = loop.time()
+        arrivals = profile.arrivals(duration)
+        next_at = next(arrivals)
+        generated = late = 0
+        max_lag = 0.0
+
+        while self.running:
+            now = loop.time() - started
+            while next_at <= now and next_at < duration:
+                lag = now - next_at
+                if lag > late_after:
+                    late += 1
+                max_lag = max(max_lag, lag)
+                template, seed = random.choice(template_names), random.getrandbits(32)
+                sms = self.create_sms(self.generate_random_number("+1234"),
+                                      self.generate_random_number("+0987"),
+                                      self.render_template(template, seed),
+                                      template=template, seed=seed)
+                loop.call_later(random.uniform(0.1, 0.5), self._complete_async, sms)
+                generated += 1
+                self.in_flight += 1
+                next_at = next(arrivals)
+            self.in_flight_peak = max(self.in_flight_peak, self.in_flight)
+            if now >= duration:
+                break
+            await asyncio.sleep(min(next_at, duration) - now)
+
+        elapsed = min(loop.time() - started, duration)
+
+        # Let in-flight messages finish (network time is at most 0.5 s)
+        while self.in_flight > 0:
+            await asyncio.sleep(0.05)
+
+        report = self._traffic_report(profile, elapsed, generated, late, max_lag)
+        report['in_flight_peak'] = self.in_flight_peak
+        self.running = False
+        return report
+
+    def _traffic_report(self, profile: TrafficProfile, elapsed: float,
+                        generated: int, late: int, max_lag: float) -> dict:
+        """Summarise a traffic run as requested vs achieved load"""
+        requested = profile.expected(elapsed) / elapsed if elapsed > 0 else 0.0
+        achieved = generated / elapsed if elapsed > 0 else 0.0
+        self.traffic_report = {
+            'profile': str(profile),
+            'requested_tps': round(requested, 1),
+            'achieved_tps': round(achieved, 1),
+            'generated': generated,
+            'late': late,
+            'max_lag_ms': round(max_lag * 1000, 1),
+            'duration': round(elapsed, 3)
+        }
+        logger.info(f"Traffic generator finished: requested {requested:.1f} TPS, "
+                    f"achieved {achieved:.1f} TPS ({generated} messages, {late} late, "
+                    f"max lag {max_lag * 1000:.1f} ms)")
+        return self.traffic_report
+
     def send_template_sms(self, template_name: str, from_num: str, to_num: str, **placeholders) -> bool:
         """Send SMS using template"""
         if template_name not in self.templates:
@@ -220,7 +963,7 @@ class SMSSimulator:
                 logger.error(f"Missing placeholder {e} for template '{template_name}'")
                 return False
         
-        sms = self.create_sms(from_num, to_num, text)
+        sms = self.create_sms(from_num, to_num, text, template=template_name)
         return self.send_sms(sms)
     
     def send_bulk_sms(self, count: int, from_num: str = None, template: str = 'welcome'):
@@ -256,38 +999,53 @@ class SMSSimulator:
         logger.info(f"Bulk SMS completed: {success_count}/{count} successful")
         return success_count
     
-    def start_traffic_generator(self, tps: int = 5, duration: int = 60):
-        """Start continuous traffic generation"""
+    def start_traffic_generator(self, tps: float = 5, duration: float = 60, engine: str = 'async',
+                                profile: TrafficProfile = None, late_after: float = 0.01):
+        """Start open-loop traffic generation in the background"""
         if self.running:
             logger.warning("Traffic generator already running")
             return
         
-        logger.info(f"Starting traffic generator: {tps} TPS for {duration} seconds")
+        profile = profile or TrafficProfile('constant', rate=tps)
         self.running = True
+        if engine == 'async':
+            self.traffic_thread = threading.Thread(
+                target=lambda: asyncio.run(self.run_traffic_async(tps, duration, profile, late_after)))
+            self.traffic_thread.start()
+            return
+
+        logger.info(f"Starting traffic generator: {profile} for {duration} seconds")
         
         def traffic_worker():
-            end_time = time.time() + duration
-            interval = 1.0 / tps
+            started = time.monotonic()
+            generated = late = 0
+            max_lag = 0.0
             
-            while self.running and time.time() < end_time:
-                start_time = time.time()
+            # Sends block, so a busy worker falls behind the timeline and
+            # reports late sends instead of quietly lowering the rate
+            for offset in profile.arrivals(duration):
+                while self.running and (delay := started + min(offset, duration) - time.monotonic()) > 0:
+                    time.sleep(min(delay, 0.5))
+                if not self.running or offset >= duration:
+                    break
+                lag = time.monotonic() - started - offset
+                if lag > late_after:
+                    late += 1
+                max_lag = max(max_lag, lag)
                 
                 # Generate random SMS
                 from_num = self.generate_random_number("+1234")
                 to_num = self.generate_random_number("+0987")
                 
                 # Random template
-                template = random.choice(list(self.templates.keys()))
-                self.send_template_sms(template, from_num, to_num, 
-                                     code=str(random.randint(100000, 999999)),
-                                     balance=f"{random.uniform(10, 100):.2f}",
-                                     amount=f"{random.uniform(1, 20):.2f}")
-                
-                # Maintain TPS rate
-                elapsed = time.time() - start_time
-                sleep_time = max(0, interval - elapsed)
-                time.sleep(sleep_time)
+                template, seed = random.choice(list(self.templates.keys())), random.getrandbits(32)
+                sms = self.create_sms(from_num, to_num, self.render_template(template, seed),
+                                      template=template, seed=seed)
+                self.send_sms(sms)
+                generated += 1
             
+            elapsed = min(time.monotonic() - started, duration)
+            self._traffic_report(profile, elapsed, generated, late, max_lag)
             self.running = False
             logger.info("Traffic generator stopped")
         
@@ -309,11 +1067,16 @@ class SMSSimulator:
         total = max(1, self.stats['total'])  # Avoid division by zero
         success_rate = (self.stats['sent'] / total) * 100
         
-        return {
+        stats = {
             **self.stats,
             'success_rate': f"{success_rate:.1f}%",
-            'total_processed': len(self.messages)
+            'total_processed': self.messages.total,
+            'message_store': self.messages.stats(),
+            'delivery_reports': self.reports.stats()
         }
+        if self.traffic_report:
+            stats['traffic'] = self.traffic_report
+        return stats
     
     def get_ss7_status(self) -> dict:
         """Get SS7 stack status via VTY"""
@@ -327,27 +1090,13 @@ class SMSSimulator:
         if filename is None:
             filename = f"sms_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        export_data = {
-            'metadata': {
-                'export_time': datetime.now().isoformat(),
-                'total_messages': len(self.messages),
-                'statistics': self.get_stats()
-            },
-            'messages': [
-                {
-                    'id': msg.id,
-                    'from': msg.from_number,
-                    'to': msg.to_number,
-                    'text': msg.text,
-                    'type': msg.message_type,
-                    'status': msg.status,
-                    'timestamp': msg.timestamp.isoformat()
-                } for msg in self.messages
-            ]
+        metadata = {
+            'export_time': datetime.now().isoformat(),
+            'total_messages': self.messages.total,
+            'statistics': self.get_stats()
         }
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, indent=2, ensure_ascii=False)
+        write_export(filename, metadata, self.messages.records())
         
         logger.info(f"Log exported to {filename}")
         return filename
@@ -357,19 +1106,82 @@ def main():
     parser = argparse.ArgumentParser(description='SS7 SMS Simulator')
     parser.add_argument('--host', default='localhost', help='VTY host (default: localhost)')
     parser.add_argument('--port', type=int, default=4239, help='VTY port (default: 4239)')
-    parser.add_argument('--mode', choices=['interactive', 'bulk', 'traffic'], 
-                       default='interactive', help='Operation mode')
+    parser.add_argument('--mode', choices=['interactive', 'bulk', 'traffic', 'rebuild'], 
+                       default='interactive',
+                       help='Operation mode (rebuild: summary JSON from a --stream prefix)')
     parser.add_argument('--count', type=int, default=10, help='Number of messages for bulk mode')
-    parser.add_argument('--tps', type=int, default=5, help='Transactions per second for traffic mode')
-    parser.add_argument('--duration', type=int, default=60, help='Duration in seconds for traffic mode')
+    parser.add_argument('--tps', type=float, default=5, help='Transactions per second for traffic mode')
+    parser.add_argument('--duration', type=float, default=60, help='Duration in seconds for traffic mode')
+    parser.add_argument('--profile',
+                       help='Arrival profile for traffic mode, e.g. poisson:rate=500, '
+                            'ramp:start=100,end=1000,step=100,every=10, '
+                            'sine:base=500,amplitude=300,period=60 (default: constant at --tps)')
+    parser.add_argument('--late-ms', type=float, default=10,
+                       help='Count a send as late when it is this far behind its arrival time')
+    parser.add_argument('--report-delay', action='append', default=[], metavar='OUTCOME=DELAY',
+                       help='Delivery report delay per send outcome (sent|failed), e.g. '
+                            'sent=uniform:1,3 or failed=exp:5; "none" disables (repeatable)')
+    parser.add_argument('--retention', type=int, default=1000000,
+                       help='Messages kept in memory; older ones spill to disk (default: 1000000)')
+    parser.add_argument('--spill-file', help='NDJSON file for messages evicted from memory '
+                                             '(default: sms_spill_<timestamp>.ndjson)')
+    parser.add_argument('--stream', nargs='?', const='', metavar='PREFIX',
+                       help='Append finished messages to NDJSON segments <PREFIX>.<n>.ndjson '
+                            '(default prefix: sms_stream_<timestamp>)')
+    parser.add_argument('--stream-rotate-mb', type=float, default=0,
+                       help='Start a new stream segment after this many MB (uncompressed)')
+    parser.add_argument('--stream-rotate-seconds', type=float, default=0,
+                       help='Start a new stream segment after this many seconds')
+    parser.add_argument('--stream-compress', choices=['gzip', 'zstd'], help='Compress stream segments')
+    parser.add_argument('--stream-fsync', default='rotate',
+                       help='fsync policy: none, rotate, always or seconds between syncs (default: rotate)')
+    parser.add_argument('--output', help='Summary file written by rebuild mode')
+    parser.add_argument('--engine', choices=['async', 'thread'], default='async',
+                       help='Traffic engine: asyncio (1k-10k TPS) or the original thread loop')
     parser.add_argument('--template', default='welcome', help='SMS template to use')
     
     args = parser.parse_args()
     
+    try:
+        profile = TrafficProfile.parse(args.profile) if args.profile else TrafficProfile('constant', rate=args.tps)
+    except ValueError as e:
+        parser.error(f"--profile: {e}" if args.profile else f"--tps: {e}")
+    
+    report_delays = {}
+    for option in args.report_delay:
+        outcome, _, spec = option.partition('=')
+        if outcome not in DeliveryScheduler.OUTCOMES:
+            parser.error(f"--report-delay: outcome must be one of {', '.join(DeliveryScheduler.OUTCOMES)}")
+        try:
+            report_delays[outcome] = None if spec == 'none' else DelayDistribution.parse(spec)
+        except ValueError as e:
+            parser.error(f"--report-delay: {e}")
+    
+    if args.mode == 'rebuild':
+        if not args.stream:
+            parser.error("rebuild mode needs --stream PREFIX")
+        if not stream_segments(args.stream):
+            parser.error(f"no stream segments found for {args.stream}")
+        print(f"Summary written to {rebuild_summary(args.stream, args.output)}")
+        return
+    
+    stream = None
+    if args.stream is not None:
+        try:
+            stream = StreamExporter(args.stream or f"sms_stream_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                                    rotate_bytes=int(args.stream_rotate_mb * 1024 * 1024),
+                                    rotate_seconds=args.stream_rotate_seconds,
+                                    compression=args.stream_compress, fsync=args.stream_fsync)
+        except ValueError as e:
+            parser.error(f"--stream: {e}")
+    
     # Initialize simulator
     simulator = SMSSimulator()
     simulator.vty.host = args.host
     simulator.vty.port = args.port
+    simulator.report_delays.update(report_delays)
+    simulator.messages = MessageStore(simulator.render_template, args.retention, args.spill_file)
+    simulator.stream = stream
     
     logger.info("SS7 SMS Simulator starting...")
     
@@ -389,7 +1201,7 @@ def main():
             print("  send <from> <to> <message> - Send single SMS")
             print("  template <name> <from> <to> - Send template SMS")
             print("  bulk <count> [template] - Send bulk SMS")
-            print("  traffic <tps> <duration> - Start traffic generator")
+            print("  traffic <tps|profile> <duration> - Start traffic generator")
             print("  stop - Stop traffic generator")
             print("  stats - Show statistics")
             print("  status - Show SS7 status")
@@ -417,8 +1229,13 @@ def main():
                         template = cmd[2] if len(cmd) > 2 else 'welcome'
                         simulator.send_bulk_sms(count, template=template)
                     elif cmd[0] == 'traffic' and len(cmd) >= 3:
-                        tps, duration = int(cmd[1]), int(cmd[2])
-                        simulator.start_traffic_generator(tps, duration)
+                        try:
+                            tps, traffic_profile = float(cmd[1]), None
+                        except ValueError:
+                            tps, traffic_profile = 0, TrafficProfile.parse(cmd[1])
+                        simulator.start_traffic_generator(tps, float(cmd[2]), engine=args.engine,
+                                                          profile=traffic_profile,
+                                                          late_after=args.late_ms / 1000)
                     elif cmd[0] == 'stop':
                         simulator.stop_traffic_generator()
                     elif cmd[0] == 'stats':
@@ -444,7 +1261,8 @@ def main():
             simulator.send_bulk_sms(args.count, template=args.template)
             
         elif args.mode == 'traffic':
-            simulator.start_traffic_generator(args.tps, args.duration)
+            simulator.start_traffic_generator(args.tps, args.duration, engine=args.engine,
+                                              profile=profile, late_after=args.late_ms / 1000)
             
             # Wait for completion
             while simulator.running:
@@ -454,6 +1272,8 @@ def main():
                     print(f"\rProcessed: {stats['total']}, Success: {stats['sent']}, Failed: {stats['failed']}", end='')
             
             print("\nTraffic generation completed")
+            if simulator.traffic_report:
+                print(json.dumps(simulator.traffic_report, indent=2))
     
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
@@ -465,11 +1285,14 @@ def main():
         # Final statistics
         stats = simulator.get_stats()
         logger.info(f"Final statistics: {stats}")
+        if simulator.stream:
+            simulator.stream.close(stats)
         
         # Auto-export log
         if simulator.messages:
             filename = simulator.export_log()
             logger.info(f"Session log saved to {filename}")
+        simulator.messages.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
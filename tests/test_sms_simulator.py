@@ -0,0 +1,127 @@
+"""
+Tests for ss7_sms_simulator.py
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ss7_sms_simulator as simulator
+
+
+def render(template, seed):
+    return f"{template}:{seed}"
+
+
+def message(n, from_number='+4915100000', to_number='4917000000', template='greeting'):
+    return simulator.SMSMessage(id=n, from_number=from_number, to_number=to_number, text=render(template, n),
+                                template=template, seed=n)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = simulator.MessageStore(render, retention=2, spill_path=str(tmp_path / 'spill.ndjson'))
+    yield store
+    store.close()
+
+
+def test_store_keeps_empty_numbers(store):
+    store.add(message(1, from_number='', to_number=''))
+    store.add(message(2))
+    store.add(message(3))
+
+    spilled = next(store.records())
+    assert (spilled['from'], spilled['to']) == ('', '')
+
+    store.add(message(4, from_number='', to_number='short code'))
+    assert [(record['from'], record['to']) for record in store.records()][-1] == ('', 'short code')
+
+
+def test_store_overwrites_the_oldest_record_and_spills_it(store):
+    messages = [message(n) for n in range(1, 6)]
+    messages[2].template, messages[2].seed = None, None
+    for sms in messages:
+        store.add(sms)
+
+    assert store.stats() == {'retained': 2, 'spilled': 3, 'retention': 2}
+    assert [record['id'] for record in store.records()] == [1, 2, 3, 4, 5]
+    with open(store.spill_path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
+    assert [record['text'] for record in store.records()] == [sms.text for sms in messages]
+    assert list(store.records())[0] == messages[0].to_record()
+
+
+@pytest.mark.parametrize('profile', ['constant:rate=200', 'ramp:start=100,end=300,step=100,every=0.5'])
+def test_async_traffic_achieves_the_requested_rate(profile):
+    sim = simulator.SMSSimulator()
+    sim.report_delays = {}
+    report = asyncio.run(sim.run_traffic_async(0, 1.0, simulator.TrafficProfile.parse(profile)))
+
+    expected = simulator.TrafficProfile.parse(profile).expected(1.0)
+    assert abs(report['generated'] - expected) <= expected * 0.02
+    assert report['achieved_tps'] == pytest.approx(report['requested_tps'], rel=0.05)
+    assert sim.stats['total'] == report['generated']
+
+
+def test_scheduler_cancels_only_the_given_report():
+    fired = []
+    scheduler = simulator.DeliveryScheduler(lambda message_id, outcome: fired.append((message_id, outcome)))
+    early = scheduler.schedule(7, 'sent', 0.05)
+    scheduler.schedule(8, 'failed', 0.05)
+    late = scheduler.schedule(7, 'sent', 0.1)
+
+    assert scheduler.cancel(early)
+    assert not scheduler.cancel(early)
+    assert scheduler.stats() == {'pending': 2, 'fired': 0, 'cancelled': 1}
+
+    deadline = time.monotonic() + 2
+    while len(fired) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fired == [(8, 'failed'), (7, 'sent')]
+    assert not scheduler.cancel(late)
+    assert scheduler.stats() == {'pending': 0, 'fired': 2, 'cancelled': 1}
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_stream_rotates_and_rebuilds_the_export(tmp_path, compression):
+    prefix = str(tmp_path / 'run')
+    exporter = simulator.StreamExporter(prefix, rotate_bytes=400, compression=compression, fsync='none')
+    messages = [message(n) for n in range(1, 11)]
+    for sms in messages:
+        sms.status = 'sent' if sms.id % 4 else 'failed'
+        exporter.write(sms)
+    statistics = {'sent': 8, 'received': 6, 'failed': 2, 'total': 10}
+    exporter.close(statistics)
+
+    assert len(simulator.stream_segments(prefix)) > 1
+    entries = list(simulator.read_stream(prefix))
+    assert entries[:-1] == [sms.to_record() for sms in messages]
+    assert entries[-1]['metadata']['statistics'] == statistics
+
+    with open(simulator.rebuild_summary(prefix, str(tmp_path / 'summary.json')), encoding='utf-8') as f:
+        summary = json.load(f)
+    assert summary['metadata']['statistics'] == statistics
+    assert summary['metadata']['total_messages'] == 10
+    assert summary['metadata']['stream']['complete']
+    assert summary['messages'] == entries[:-1]
+
+
+def test_rebuild_recounts_a_stream_without_its_closing_line(tmp_path):
+    prefix = str(tmp_path / 'crashed')
+    exporter = simulator.StreamExporter(prefix, fsync='none')
+    for n in range(1, 4):
+        sms = message(n)
+        sms.status = 'sent' if n < 3 else 'failed'
+        exporter.write(sms)
+    exporter.close()
+
+    with open(simulator.rebuild_summary(prefix, str(tmp_path / 'summary.json')), encoding='utf-8') as f:
+        metadata = json.load(f)['metadata']
+    assert not metadata['stream']['complete']
+    assert (metadata['statistics']['sent'], metadata['statistics']['failed']) == (2, 1)
@@ -0,0 +1,401 @@
+"""
+Tests for scripts/vty_proxy.py against the local VTY emulator
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import socket
+import contextlib
+import sqlite3
+import importlib
+import subprocess
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+EMULATOR_PORTS = {'stp': 4239, 'msc': 4254, 'bsc': 4242, 'hlr': 4258, 'mgw': 2427}
+PORT_OFFSET = 23000
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"emulator did not listen on port {port}")
+
+
+@pytest.fixture(scope='module')
+def proxy():
+    """vty_proxy module wired to a vty_emulator subprocess"""
+    emulator = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, 'vty_emulator.py'), '--port-offset', str(PORT_OFFSET)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for port in EMULATOR_PORTS.values():
+            wait_for_port(port + PORT_OFFSET)
+
+        for service, port in EMULATOR_PORTS.items():
+            os.environ[f'OSMO_{service.upper()}_HOST'] = '127.0.0.1'
+            os.environ[f'OSMO_{service.upper()}_PORT'] = str(port + PORT_OFFSET)
+        os.environ['STATUS_POLL_INTERVAL'] = '0'
+        sys.path.insert(0, SCRIPTS_DIR)
+        module = importlib.import_module('vty_proxy')
+        yield module
+    finally:
+        emulator.terminate()
+        emulator.wait(timeout=5)
+
+
+@pytest.fixture
+def client(proxy):
+    return proxy.app.test_client()
+
+
+def test_session_left_in_config_mode_is_not_reused(proxy, client):
+    reply = client.post('/api/command/batch', json={'commands': [
+        {'service': 'stp', 'command': 'enable'},
+        {'service': 'stp', 'command': 'configure terminal'},
+    ]})
+    assert reply.status_code == 200
+
+    for _ in range(3):
+        reply = client.post('/api/command', json={'service': 'stp', 'command': 'show cs7 instance 0 users'},
+                            headers={'Cache-Control': 'no-cache'})
+        assert reply.status_code == 200
+        assert reply.get_json()['result']['output']
+
+    assert all(vty.node == 'view' for vty, _ in proxy.vty_pools['stp']._idle)
+
+
+@pytest.fixture
+def hlr_db(proxy, tmp_path, monkeypatch):
+    """Small OsmoHLR-style subscriber table behind the proxy's read path"""
+    path = str(tmp_path / 'hlr.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE subscriber (id INTEGER PRIMARY KEY, imsi VARCHAR(15) UNIQUE NOT NULL, "
+                 "msisdn VARCHAR(15) UNIQUE, imei VARCHAR(14), nam_cs BOOLEAN NOT NULL DEFAULT 1, "
+                 "nam_ps BOOLEAN NOT NULL DEFAULT 1, vlr_number VARCHAR(15), msc_number VARCHAR(15), "
+                 "last_lu_seen TIMESTAMP default NULL)")
+    conn.executemany("INSERT INTO subscriber (imsi, msisdn) VALUES (?, ?)",
+                     [(f'00101000000{n:04d}', f'{1000 + n}') for n in range(20)])
+    conn.commit()
+    conn.close()
+
+    db = proxy.HLRDatabase(path)
+    monkeypatch.setattr(proxy, 'hlr_db', db)
+    monkeypatch.setattr(proxy, 'SUBSCRIBER_PAGE_MAX', 5)
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('limit', ['0', '-1'])
+def test_subscriber_limit_below_one_returns_one_row(client, hlr_db, limit):
+    reply = client.get(f'/api/subscribers?limit={limit}')
+    assert reply.status_code == 200
+    assert len(reply.get_json()['subscribers']) == 1
+
+
+def test_subscriber_limit_is_capped(client, hlr_db):
+    reply = client.get('/api/subscribers?limit=1000')
+    assert reply.status_code == 200
+    assert len(reply.get_json()['subscribers']) == 5
+
+
+def test_subscriber_limit_must_be_an_integer(client, hlr_db):
+    reply = client.get('/api/subscribers?limit=ten')
+    assert reply.status_code == 400
+    assert 'limit' in reply.get_json()['error']
+
+
+def test_snapshot_never_serves_failed_results(proxy, monkeypatch):
+    collector = proxy.StatusCollector({'stp': ['show cs7 instance 0 asp']})
+    monkeypatch.setitem(collector.results, ('stp', 'show cs7 instance 0 asp'),
+                        ({'error': 'timed out', 'success': False}, time.time()))
+    assert collector.lookup('stp', 'show cs7 instance 0 asp') is None
+
+    collector.results[('stp', 'show cs7 instance 0 asp')] = ({'output': '% Unknown command.', 'success': True},
+                                                              time.time())
+    assert collector.lookup('stp', 'show cs7 instance 0 asp') is None
+
+
+def test_snapshot_reuse_is_capped_at_the_command_ttl(proxy):
+    collector = proxy.StatusCollector({'msc': ['show stats']}, ttl=15)
+    ok = {'output': 'counters', 'success': True}
+    collector.results[('msc', 'show stats')] = (ok, time.time() - 1)
+    assert collector.lookup('msc', 'show stats')[0] == ok
+
+    stats_ttl = proxy.command_cache.ttl_for('show stats')
+    collector.results[('msc', 'show stats')] = (ok, time.time() - stats_ttl - 1)
+    assert collector.lookup('msc', 'show stats') is None
+
+
+def test_status_snapshot_keeps_the_failure_reason(proxy, monkeypatch):
+    async def fan_out(collect):
+        return {'bsc': {'connected': False, 'data': {}, 'timed_out': False,
+                        'error': 'Circuit open for bsc; retry in 1.0s', 'status': 'circuit_open'}}
+
+    monkeypatch.setattr(proxy, 'fan_out', fan_out)
+    collector = proxy.StatusCollector({})
+    asyncio.run(collector._collect())
+
+    status = collector.service_status('bsc', [])
+    assert status['status'] == 'circuit_open'
+    assert status['error'].startswith('Circuit open')
+
+
+def test_sms_jobs_in_progress_are_never_evicted(proxy, monkeypatch):
+    async def ensure_subscriber(msisdn):
+        return None
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def send(service, to_number, from_number, message):
+            await gate.wait()
+            return {'output': '', 'success': True}, 'sms-send'
+
+        monkeypatch.setattr(proxy, 'ensure_subscriber', ensure_subscriber)
+        monkeypatch.setattr(proxy.sms_formats, 'send', send)
+        sms_queue = proxy.SMSQueue(size=10, concurrency=1, rate=0, history=2)
+        sms_queue.start(asyncio.get_running_loop())
+
+        jobs = [await sms_queue.enqueue('msc', '1000', str(2000 + n), 'hi') for n in range(5)]
+        await asyncio.sleep(0.01)
+        assert all(sms_queue.get(job['id']) for job in jobs)
+
+        gate.set()
+        await sms_queue._queue.join()
+        kept = [job['id'] for job in jobs if sms_queue.get(job['id'])]
+        assert kept == [job['id'] for job in jobs[-2:]]
+        assert all(sms_queue.get(job_id)['state'] == 'sent' for job_id in kept)
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def slow_stp():
+    """(host, port) of an STP emulator that answers every command after 500 ms"""
+    port = EMULATOR_PORTS['stp'] + PORT_OFFSET + 1000
+    emulator = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, 'vty_emulator.py'), '--services', 'stp',
+         '--port-offset', str(PORT_OFFSET + 1000), '--latency', '500'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        yield '127.0.0.1', port
+    finally:
+        emulator.terminate()
+        emulator.wait(timeout=5)
+
+
+def test_timed_out_command_drops_the_session(proxy, slow_stp):
+    host, port = slow_stp
+    first, second = 'show cs7 instance 0 asp', 'show cs7 instance 0 users'
+
+    async def scenario():
+        reference = proxy.VTYConnection(host, port, timeout=2)
+        expected = await reference.send_command(second)
+        reference.disconnect()
+
+        vty = proxy.VTYConnection(host, port, timeout=0.3)
+        timed_out = await vty.send_command(first)
+        assert timed_out == {'error': 'Command timed out', 'success': False}
+        assert not vty.connected
+
+        # The first reply is still due; it must not be taken for the second one's
+        vty.timeout = 2
+        assert await vty.send_command(second) == expected
+        vty.disconnect()
+
+    asyncio.run(scenario())
+
+
+def bulk_lines(reply):
+    return [json.loads(line) for line in reply.get_data(as_text=True).splitlines()]
+
+
+def test_bulk_reports_unparsable_rows_and_continues(client):
+    body = '{"msisdn": "4900001"}\nnot json\n[1, 2]\n{"msisdn": "4900002"}\n'
+    lines = bulk_lines(client.post('/api/subscribers/bulk?format=ndjson', data=body))
+
+    rows = {line['row']: line for line in lines if 'row' in line}
+    assert [rows[n]['ok'] for n in range(4)] == [True, False, False, True]
+    assert rows[1]['error'].startswith('Invalid row')
+    assert lines[-1]['summary'] == dict(lines[-1]['summary'], offset=4, rows=4, ok=2, failed=2)
+
+
+def test_bulk_offset_skips_rows_without_parsing_them(client):
+    body = 'not json\n{"msisdn": "4900003"}\n'
+    lines = bulk_lines(client.post('/api/subscribers/bulk?format=ndjson&offset=1', data=body))
+
+    assert [line['row'] for line in lines if 'row' in line] == [1]
+    assert lines[-1]['summary']['failed'] == 0
+
+
+class ScriptedVTY:
+    """Stands in for a pooled VTY session, answering commands from a script"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.commands = []
+
+    async def send_command(self, command):
+        self.commands.append(command)
+        return {'output': self.replies.get(command.split()[0], ''), 'success': True}
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        yield self
+
+
+def sms_formats_with(proxy, monkeypatch, replies):
+    vty = ScriptedVTY(replies)
+    monkeypatch.setitem(proxy.vty_pools, 'msc', vty)
+    formats = proxy.SMSCommandFormats()
+    formats.remember('msc', proxy.SMS_COMMAND_FORMATS[1], 'list')
+    return formats, vty
+
+
+def test_sms_send_returns_msc_errors_without_reprobing(proxy, monkeypatch):
+    formats, vty = sms_formats_with(proxy, monkeypatch, {'subscriber': "% No subscriber for msisdn = '4900'"})
+    result, name = asyncio.run(formats.send('msc', '4900', '1000', 'hi'))
+
+    assert proxy.vty_error(result) == "% No subscriber for msisdn = '4900'"
+    assert name == 'subscriber-sms-send'
+    assert len(vty.commands) == 1
+    assert formats.formats['msc']['name'] == 'subscriber-sms-send'
+
+
+def test_sms_send_reprobes_on_syntax_errors(proxy, monkeypatch):
+    formats, vty = sms_formats_with(proxy, monkeypatch, {'subscriber': '% Unknown command.',
+                                                          'list': '  sms send .LINE'})
+    result, name = asyncio.run(formats.send('msc', '4900', '1000', 'hi'))
+
+    assert name == 'sms-send'
+    assert vty.commands[1] == 'list'
+    assert formats.formats['msc']['name'] == 'sms-send'
+
+
+def test_auto_created_subscriber_is_cached(proxy):
+    msisdn = '4917000042'
+    proxy.subscriber_cache.invalidate(msisdn)
+    created = proxy.vty_engine.run(proxy.ensure_subscriber(msisdn))
+    assert created['created']
+    assert proxy.subscriber_cache.get(msisdn) == (True, created['imsi'])
+
+    again = proxy.vty_engine.run(proxy.ensure_subscriber(msisdn))
+    assert again == {'exists': True, 'imsi': created['imsi'], 'cached': True}
+
+
+def run_command(client, service, command, **extra):
+    reply = client.post('/api/command', json=dict(extra, service=service, command=command))
+    assert reply.status_code == 200
+    return reply.get_json()
+
+
+def test_pool_reuses_sessions(proxy, client):
+    pool = proxy.vty_pools['mgw']
+    run_command(client, 'mgw', 'show mgcp stats', cache='no-cache')
+    idle = [vty for vty, _ in pool._idle]
+    assert len(idle) == 1
+
+    for _ in range(3):
+        assert not run_command(client, 'mgw', 'show mgcp stats', cache='no-cache')['cached']
+    assert [vty for vty, _ in pool._idle] == idle
+    assert pool.in_use == 0
+
+
+def test_breaker_opens_then_half_opens_then_closes(proxy):
+    breaker = proxy.CircuitBreaker(threshold=2, backoff=0.05, backoff_max=1, name='test')
+    breaker.record(False)
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open' and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == 'half_open'
+    assert not breaker.allow()  # one trial at a time
+
+    # A failed trial reopens with the backoff doubled
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.retry_after() > 0.05
+    time.sleep(0.11)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.failures == 0 and breaker.allow()
+
+
+def test_unreachable_backend_opens_the_circuit(proxy):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    async def scenario():
+        pool = proxy.VTYPool('127.0.0.1', port, service='dead')
+        pool.breaker = proxy.CircuitBreaker(threshold=1, backoff=30, name='dead')
+        with pytest.raises(proxy.VTYUnavailable):
+            await pool.checkout()
+        with pytest.raises(proxy.VTYCircuitOpen):
+            await pool.checkout()
+        assert pool.stats()['circuit']['state'] == 'open'
+
+    proxy.vty_engine.run(scenario())
+
+
+def test_non_show_command_invalidates_cached_results(proxy, client):
+    first = run_command(client, 'bsc', 'show network')
+    assert run_command(client, 'bsc', 'show network')['cached']
+
+    generation = proxy.command_cache.generation('bsc')
+    run_command(client, 'bsc', 'write terminal')
+    assert proxy.command_cache.generation('bsc') > generation
+    assert not run_command(client, 'bsc', 'show network')['cached']
+
+    # A reply to a command that was in flight across the invalidation is not stored
+    proxy.command_cache.invalidate('bsc')
+    proxy.command_cache.put('bsc', 'show network', first['result'], generation)
+    assert proxy.command_cache.get('bsc', 'show network') is None
+
+
+def test_unchanged_get_returns_304(client):
+    reply = client.get('/api/services')
+    etag = reply.headers['ETag']
+    assert reply.status_code == 200 and etag.startswith('W/"')
+
+    again = client.get('/api/services', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag and not again.get_data()
+
+    assert client.get('/api/services', headers={'If-None-Match': 'W/"stale"'}).status_code == 200
+
+
+def test_batch_keeps_request_order_across_services(client):
+    commands = [{'service': 'bsc', 'command': 'show network'},
+                {'service': 'stp', 'command': 'show cs7 instance 0 users'},
+                {'service': 'bsc', 'command': 'show bts'},
+                {'service': 'mgw', 'command': 'show mgcp stats'}]
+    results = client.post('/api/command/batch', json={'commands': commands}).get_json()['results']
+
+    assert [(r['service'], r['command']) for r in results] == [(c['service'], c['command']) for c in commands]
+    assert all(r['result']['success'] and r['vty_error'] is None for r in results)
+
+
+def test_batch_stop_on_error_skips_the_rest_of_the_service(client):
+    reply = client.post('/api/command/batch', json={'service': 'bsc', 'stop_on_error': True, 'commands': [
+        'show network', 'show nonsense', 'show bts',
+        {'service': 'mgw', 'command': 'show mgcp stats'},
+    ]})
+    results = reply.get_json()['results']
+
+    assert results[0]['vty_error'] is None
+    assert results[1]['vty_error'].startswith('%')
+    assert results[2] == {'service': 'bsc', 'command': 'show bts', 'skipped': True}
+    assert results[3]['vty_error'] is None